@@ -1,111 +1,315 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 import os
-from passport_ocr import get_data
-from orientation_detector import detect_face, rotate_bound
-import cv2
-from pdf_extractor import process_pdf
-from datetime import datetime
+import time
 import hashlib
-from db_utils import initialize_database, get_cached_result, cache_result
+import metrics
+from metrics import REGISTRY, REQUEST_SECONDS, Gauge, timed
+from db_utils import PoolTimeout
+from db_utils import pool_stats as db_pool_stats
+from ocr_engine import get_reader_pool, pool_stats
+from ocr_batcher import get_batcher, batcher_stats
+from pipeline import PipelineError, allowed_file, process_document
+from batch import iter_upload_items, run_batch
+from result_cache import get_result_cache
+from jobs import JobQueue, QueueFull
+from singleflight import SINGLE_FLIGHT_LEASES, CacheLease, SingleFlight
+from startup import MODEL_STEP_NAMES, MODEL_STEPS, WARM_UP_MODE, Readiness
+from memory import model_memory, process_memory
+from resolution import MAX_UPLOAD_BYTES
+from near_duplicates import NEAR_DUPLICATES, get_near_duplicate_index, near_duplicate_stats
+from intake import IntakeRequest, digest_header, upload_content, upload_hash
+from werkzeug.exceptions import RequestEntityTooLarge
 
 app = Flask(__name__)
+# Uploaded files are hashed and size-checked as the body streams in
+app.request_class = IntakeRequest
 UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'pdf'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Uploads and intermediate images are only written to UPLOAD_FOLDER when debugging
+app.config['SAVE_DEBUG_IMAGES'] = os.getenv('SAVE_DEBUG_IMAGES', '0') == '1'
+# Per-request stage timings go out in a Server-Timing header when the client
+# sends "X-Trace: 1", or on every response when TRACE_ALL_REQUESTS is set
+app.config['TRACE_ALL_REQUESTS'] = os.getenv('TRACE_ALL_REQUESTS', '0') == '1'
+app.config['WARM_UP'] = WARM_UP_MODE
+# Single uploads are held to MAX_UPLOAD_BYTES as they stream in (batch items
+# get a per-item error instead); the request limit leaves room for batches
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_REQUEST_BYTES', str(8 * MAX_UPLOAD_BYTES)))
 
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
 
+upload_flights = SingleFlight()
+# Leases live next to file_cache, so they only apply to the MSSQL backend
+cache_lease = CacheLease() if SINGLE_FLIGHT_LEASES and get_result_cache().backend.name == 'mssql' else None
 
-initialize_database()
+# Importing this module only registers routes; models and database tables
+# are set up by the warm-up steps, which /readyz reports on
+warm_up_steps = MODEL_STEPS + [('result_cache', lambda: get_result_cache().initialize())]
+if cache_lease:
+    warm_up_steps.append(('cache_lease', cache_lease.initialize))
+if NEAR_DUPLICATES:
+    warm_up_steps.append(('near_duplicates', lambda: get_near_duplicate_index().load()))
+readiness = Readiness(warm_up_steps)
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def create_app(warm_up=None):
+    # Entry point for servers, e.g. gunicorn "application:create_app()"
+    if warm_up is not None:
+        app.config['WARM_UP'] = warm_up
+    if app.config['WARM_UP'] == 'preload':
+        from prefork import preload, will_fork
+        if will_fork():
+            # The master loads the models; each forked worker then runs the
+            # database steps itself
+            preload(readiness, MODEL_STEP_NAMES)
+            return app
+        # Nothing will fork this process, so it has to serve and reach ready itself
+        print("WARM_UP=preload needs a preforking server (gunicorn -c gunicorn.conf.py); warming up in the background instead")
+        readiness.start()
+    elif app.config['WARM_UP'] != 'off':
+        readiness.start(blocking=app.config['WARM_UP'] == 'blocking')
+    return app
 
-def save_detected_face(img):
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"detected_face_{timestamp}.jpeg"
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    cv2.imwrite(filepath, img, [cv2.IMWRITE_JPEG_QUALITY, 95])
-    return filepath
+def debug_folder():
+    return app.config['UPLOAD_FOLDER'] if app.config['SAVE_DEBUG_IMAGES'] else None
 
-def remove_temporary_files(detected_face_path, extracted_image_path=None):
-    if os.path.exists(detected_face_path):
-        os.remove(detected_face_path)
-    if extracted_image_path and os.path.exists(extracted_image_path):
-        os.remove(extracted_image_path)
+def mrz_cache_key(file_hash):
+    # MRZ-only results are cached apart from full ones, under a key that
+    # still fits file_cache.file_hash
+    return hashlib.md5(f'{file_hash}:mrz'.encode()).hexdigest()
+
+def compute_upload(file_hash, filename, content, mrz_only=False):
+    # A pooled connection is only borrowed for each database step, never
+    # while the pipeline runs: a slow OCR run must not keep a transaction
+    # open or count against DB_POOL_SIZE
+    leased = False
+    try:
+        # Check cache before processing; local hits never touch the database
+        with timed('cache_lookup'):
+            cached_result = get_result_cache().get(file_hash)
+        if cached_result:
+            return {
+                'file_name': cached_result['file_name'],
+                'result': cached_result['result']
+            }, 200
+
+        if cache_lease:
+            leased, cached_result = cache_lease.acquire_or_wait(
+                file_hash, lambda: get_result_cache().backend.get(file_hash))
+            if cached_result:
+                return cached_result, 200
+    except PoolTimeout:
+        return {'error': 'Database unavailable, try again later'}, 503
+    except Exception as e:
+        # e.g. the database refused the connection or the query
+        print(f"Cache lookup failed for {file_hash}: {e}")
+        return {'error': 'Database unavailable, try again later'}, 503
+
+    try:
+        # If not in cache, process the file in memory
+        try:
+            data = process_document(filename, upload_content(content), debug_folder(), mrz_only=mrz_only,
+                                    file_hash=file_hash,
+                                    get_cached=get_result_cache().peek)
+        except PipelineError as e:
+            return {'error': e.message}, e.status_code
+
+        # Cache the result in the database
+        try:
+            with timed('cache_write'):
+                get_result_cache().put(file_hash, filename, data)
+        except Exception as e:
+            # The result is still good (and shared with any single-flight
+            # followers); only the next upload misses the cache
+            print(f"Cache write failed for {file_hash}: {e}")
+    finally:
+        if leased:
+            try:
+                cache_lease.release(file_hash)
+            except Exception as e:
+                # Left to expire after its ttl
+                print(f"Lease release failed for {file_hash}: {e}")
+
+    return {
+        'file_name': filename,
+        'result': data
+    }, 200
+
+def process_upload(filename, content, file_hash, mrz_only=False):
+    # Returns (response, status_code) for one document. Concurrent uploads of
+    # the same file share a single pipeline run. Used by /upload (content is
+    # the upload's spool) and the job workers (content is bytes).
+    cached_result = get_result_cache().get_local(file_hash)
+    if cached_result:
+        # A full result answers MRZ-only requests too
+        return cached_result, 200
+    cache_key = file_hash
+    if mrz_only:
+        cache_key = mrz_cache_key(file_hash)
+        cached_result = get_result_cache().get_local(cache_key)
+        if cached_result:
+            return cached_result, 200
+    (response, status_code), shared = upload_flights.do(cache_key, compute_upload, cache_key, filename, content, mrz_only)
+    return response, status_code
+
+job_queue = JobQueue(process_upload)
+
+REGISTRY.register(Gauge('passport_ocr_readers', 'easyocr readers in the pool by state.',
+                        lambda: {('total',): get_reader_pool().size, ('in_use',): get_reader_pool().stats()['in_use']}, ['state']))
+REGISTRY.register(Gauge('passport_db_pool_connections', 'Pooled database connections by state.',
+                        lambda: {(key,): db_pool_stats()[key] for key in ('open', 'idle', 'in_use')}, ['state']))
+REGISTRY.register(Gauge('passport_job_queue_depth', 'Jobs waiting for a worker.', lambda: job_queue.stats()['queued']))
+REGISTRY.register(Gauge('passport_memory_bytes', 'Memory of this worker process by kind.',
+                        lambda: {(key,): value for key, value in process_memory().items()}, ['kind']))
+REGISTRY.register(Gauge('passport_near_duplicate_hit_ratio', 'Share of exact cache misses answered by a near-duplicate.',
+                        lambda: near_duplicate_stats()['hit_ratio']))
+REGISTRY.register(Gauge('passport_ready', 'Whether warm-up has finished (1) or not (0).', lambda: int(readiness.is_ready())))
+
+@app.before_request
+def ensure_warm_up_started():
+    # Servers that load `app` directly rather than through create_app start
+    # warming up on their first request (typically a readiness probe)
+    if not readiness.started and app.config['WARM_UP'] != 'off':
+        readiness.start()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if app.config['TRACE_ALL_REQUESTS'] or request.headers.get('X-Trace') in ('1', 'true'):
+        g.trace = metrics.start_trace()
+
+@app.after_request
+def record_request_timing(response):
+    elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+    REQUEST_SECONDS.observe(elapsed, endpoint=request.endpoint or 'unknown', status=str(response.status_code))
+    trace = g.get('trace')
+    if trace is not None:
+        response.headers['Server-Timing'] = metrics.server_timing(trace + [('total', elapsed)])
+        metrics.end_trace()
+    return response
+
+@app.route('/healthz', methods=['GET'])
+def liveness():
+    return jsonify({'status': 'ok'}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readiness_probe():
+    status = readiness.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return jsonify({'error': e.description}), 413
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
+    # Reading the body hashes the upload on the way in (see intake.py), and
+    # stops as soon as the document passes MAX_UPLOAD_BYTES
+    request.max_document_bytes = MAX_UPLOAD_BYTES
+    with timed('upload_read'):
+        files = request.files
+    if 'file' not in files:
+        return jsonify({'error': 'No file part'}), 400
+    file = files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+    if file and allowed_file(file.filename):
+        file_hash = upload_hash(file)
+        # ?mode=mrz returns only the MRZ fields, skipping full-page OCR
+        # whenever the MRZ passes its check digits
+        mrz_only = request.args.get('mode') == 'mrz'
+        # The bytes are only read out of the spool if the cache misses
+        response, status_code = process_upload(file.filename, file.stream, file_hash, mrz_only)
+        response = jsonify(response)
+        digest = digest_header(file)
+        if digest:
+            response.headers['Repr-Digest'] = digest
+        return response, status_code
+    else:
+        return jsonify({'error': 'Allowed file types are jpg, jpeg, pdf only'}), 400
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    request.max_document_bytes = MAX_UPLOAD_BYTES
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
-    if file and allowed_file(file.filename):
-        # Calculate hash of the uploaded file content
-        file_hash = hashlib.md5(file.read()).hexdigest()
-        file.seek(0)  
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'Allowed file types are jpg, jpeg, pdf only'}), 400
 
-        # Check cache before saving or processing
-        cached_result = get_cached_result(file_hash)
-        if cached_result:
-            return jsonify({
-                'file_name': cached_result['file_name'],
-                'result': cached_result['result']
-            }), 200
+    file_hash = upload_hash(file)
+    cached_result = get_result_cache().get_local(file_hash)
+    if cached_result:
+        job = job_queue.add_finished(file.filename, file_hash, cached_result, 200)
+    else:
+        try:
+            # Jobs outlive the request and its spool, so they get the bytes
+            job = job_queue.submit(file.filename, upload_content(file.stream), file_hash)
+        except QueueFull as e:
+            response = jsonify({'error': 'Too many pending jobs, try again later'})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 429
 
-        # If not in cache, save and process the file
-        filename = file.filename
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+    response = jsonify(job.to_dict())
+    response.headers['Location'] = f'/jobs/{job.id}'
+    return response, 202
 
-        extracted_image_path = None
-        if filename.endswith('.pdf'):
-            extracted_image_path = process_pdf(filepath, app.config['UPLOAD_FOLDER'])
-            filepath = extracted_image_path  # Use the extracted image for further processing
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job id'}), 404
+    return jsonify(job.to_dict()), 200
 
-        # Perform orientation detection and face detection
-        img = cv2.imread(filepath)
-        if img is None:
-            return jsonify({'error': 'Failed to load uploaded image'}), 500
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    files = request.files.getlist('files') + request.files.getlist('file')
+    if not files:
+        return jsonify({'error': 'No file part'}), 400
+    # Read everything while the request is still available, then stream one
+    # NDJSON line per document as results come back from the worker pool
+    items = list(iter_upload_items(files))
+    if not items:
+        return jsonify({'error': 'No selected file'}), 400
+    return Response(stream_with_context(run_batch(items, get_result_cache())), mimetype='application/x-ndjson')
 
-        start_angle = 0
-        end_angle = 270
-        step_angle = 90
-        face_detected = False
-        rotated_img = img.copy()
+@app.route('/ocr/stats', methods=['GET'])
+def ocr_stats():
+    stats = pool_stats()
+    if get_batcher().max_wait > 0:
+        stats['batcher'] = batcher_stats()
+    return jsonify(stats), 200
 
-        # Attempt face detection with rotation
-        while not face_detected and start_angle <= end_angle:
-            rotated_img = rotate_bound(img, start_angle)
-            face_detected, face = detect_face(rotated_img)
-            start_angle += step_angle
+@app.route('/memory', methods=['GET'])
+def memory_stats():
+    # Shared versus private memory of the worker that answers, overall and
+    # per loaded model; load_bytes is what each warm-up step allocated
+    return jsonify({
+        'pid': os.getpid(),
+        'process': process_memory(),
+        'models': model_memory(),
+        'load_bytes': readiness.status()['step_memory_bytes'],
+    }), 200
 
-        if not face_detected:
-            return jsonify({'error': 'No face detected after rotating through 270 degrees.'}), 404
+@app.route('/db/stats', methods=['GET'])
+def db_stats():
+    return jsonify(db_pool_stats()), 200
 
-        detected_face_path = save_detected_face(rotated_img)
+@app.route('/jobs/stats', methods=['GET'])
+def jobs_stats():
+    return jsonify(job_queue.stats()), 200
 
-        try:
-            data = get_data(detected_face_path)
-            '''
-            print("Data extracted:", data)  
-            '''
-            remove_temporary_files(detected_face_path, extracted_image_path)
-            
-            # Cache the result in the database
-            cache_result(file_hash, filename, data)
-            
-            return jsonify({
-                'file_name': filename,
-                'result': data
-            }), 200
-        except Exception as e:
-            remove_temporary_files(detected_face_path, extracted_image_path)
-            return jsonify({'error': str(e)}), 500
-    else:
-        return jsonify({'error': 'Allowed file types are jpg, jpeg, pdf only'}), 400
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    stats = get_result_cache().stats()
+    stats['single_flight'] = upload_flights.stats()
+    if NEAR_DUPLICATES:
+        # Reported apart from the exact (file hash) hits above
+        stats['near_duplicates'] = near_duplicate_stats()
+    return jsonify(stats), 200
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pipeline import allowed_file
+from resolution import MAX_UPLOAD_BYTES
+
+# Stand in for the content of documents that are never read: archive members
+# over MAX_UPLOAD_BYTES, documents past the batch's uncompressed byte budget,
+# and archives with more members than a batch may hold
+TOO_LARGE = object()
+OVER_BUDGET = object()
+TOO_MANY = object()
+
+# Zip sizes and member counts come from the archive's headers, so both limits
+# are enforced before anything is decompressed
+BATCH_MAX_DOCUMENTS = int(os.getenv('BATCH_MAX_DOCUMENTS', '500'))
+BATCH_MAX_UNCOMPRESSED_BYTES = int(os.getenv('BATCH_MAX_UNCOMPRESSED_BYTES', str(8 * MAX_UPLOAD_BYTES)))
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+CACHE_WRITE_BATCH = int(os.getenv('CACHE_WRITE_BATCH', '50'))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def is_zip(filename):
+    return filename.lower().endswith('.zip')
+
+def upload_size(file):
+    # Size of an uploaded file without reading it into memory
+    position = file.stream.tell()
+    file.stream.seek(0, os.SEEK_END)
+    size = file.stream.tell()
+    file.stream.seek(position)
+    return size
+
+def iter_upload_items(files):
+    # Yields (file_name, content) for every uploaded document, expanding zip
+    # archives; unsupported entries come back with content None. Everything
+    # read counts against BATCH_MAX_UNCOMPRESSED_BYTES and BATCH_MAX_DOCUMENTS.
+    documents = 0
+    budget = BATCH_MAX_UNCOMPRESSED_BYTES
+    for file in files:
+        if not file.filename:
+            continue
+        if is_zip(file.filename):
+            try:
+                # Read in place from the upload's spool rather than copied
+                archive = zipfile.ZipFile(file.stream)
+            except zipfile.BadZipFile:
+                yield file.filename, None
+                continue
+            with archive:
+                members = [
+                    info for info in archive.infolist()
+                    if not (info.is_dir() or info.filename.startswith('__MACOSX/')
+                            or os.path.basename(info.filename).startswith('.'))
+                ]
+                if documents + len(members) > BATCH_MAX_DOCUMENTS:
+                    yield file.filename, TOO_MANY
+                    continue
+                documents += len(members)
+                for info in members:
+                    name = info.filename
+                    if not allowed_file(name):
+                        yield name, None
+                    elif info.file_size > MAX_UPLOAD_BYTES:
+                        yield name, TOO_LARGE
+                    elif info.file_size > budget:
+                        yield name, OVER_BUDGET
+                    else:
+                        # zipfile stops decompressing at the header's file_size,
+                        # so the budget holds even if the header lies
+                        budget -= info.file_size
+                        yield name, archive.read(info)
+            continue
+        documents += 1
+        size = upload_size(file)
+        if documents > BATCH_MAX_DOCUMENTS:
+            yield file.filename, TOO_MANY
+        elif not allowed_file(file.filename):
+            yield file.filename, None
+        elif size > MAX_UPLOAD_BYTES:
+            yield file.filename, TOO_LARGE
+        elif size > budget:
+            yield file.filename, OVER_BUDGET
+        else:
+            budget -= size
+            yield file.filename, file.read()
+
+def init_worker():
+    # Each worker is a fresh (spawned) interpreter that loads its own dlib
+    # detector and a single easyocr reader before taking any work. It reads
+    # one document at a time, so there is nothing for the OCR batcher to wait for.
+    from ocr_engine import configure_reader_pool
+    from ocr_batcher import configure_batcher
+    from startup import load_models
+    configure_reader_pool(1)
+    configure_batcher(max_wait=0)
+    load_models()
+
+def process_item(file_name, content, mrz_only=False):
+    from pipeline import PipelineError, process_document
+    try:
+        return {'file_name': file_name, 'result': process_document(file_name, content, mrz_only=mrz_only)}
+    except PipelineError as e:
+        return {'file_name': file_name, 'error': e.message, 'status': e.status_code}
+    except Exception as e:
+        return {'file_name': file_name, 'error': str(e), 'status': 500}
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn rather than fork: this runs inside threaded server workers,
+                # and forking a process with live threads (torch's included) is unsafe
+                _executor = ProcessPoolExecutor(
+                    max_workers=BATCH_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=init_worker,
+                )
+    return _executor
+
+def reset_executor(broken=None):
+    # Drop a broken pool so the next batch starts a fresh one. Its remaining
+    # worker processes are shut down without waiting on them; a pool another
+    # batch already put in its place is left alone.
+    global _executor
+    with _executor_lock:
+        if broken is not None and _executor is not broken:
+            executor = broken
+        else:
+            executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def item_line(file_name, file_hash, outcome, cached=False):
+    line = {'file_name': file_name, 'file_hash': file_hash, 'cached': cached}
+    if 'error' in outcome:
+        line.update({'status': 'error', 'error': outcome['error'], 'code': outcome.get('status', 500)})
+    elif isinstance(outcome['result'], str):
+        # get_data reports unreadable scans as a message rather than an exception
+        line.update({'status': 'error', 'error': outcome['result'], 'code': 422})
+    else:
+        line.update({'status': 'ok', 'result': outcome['result']})
+    return json.dumps(line) + '\n'
+
+def skipped_outcome(content):
+    # The per-item error for a document iter_upload_items did not read, or
+    # None if content is the document itself
+    if content is None:
+        return {'error': 'Allowed file types are jpg, jpeg, pdf only', 'status': 400}
+    if content is TOO_LARGE:
+        return {'error': f'File exceeds the {MAX_UPLOAD_BYTES} byte limit', 'status': 413}
+    if content is OVER_BUDGET:
+        return {'error': f'Batch exceeds its {BATCH_MAX_UNCOMPRESSED_BYTES} byte uncompressed limit', 'status': 413}
+    if content is TOO_MANY:
+        return {'error': f'Batch exceeds its {BATCH_MAX_DOCUMENTS} document limit', 'status': 413}
+    return None
+
+def run_batch(items, cache, executor=None):
+    # Yields one NDJSON line per input document as soon as its result is
+    # known: cached and duplicate documents first, then pipeline results in
+    # completion order
+    shared = executor is None
+    executor = executor or get_executor()
+    by_hash = {}
+    for file_name, content in items:
+        skipped = skipped_outcome(content)
+        if skipped:
+            yield item_line(file_name, None, skipped)
+            continue
+        file_hash = hashlib.md5(content).hexdigest()
+        if file_hash in by_hash:
+            by_hash[file_hash]['names'].append(file_name)
+        else:
+            by_hash[file_hash] = {'names': [file_name], 'content': content}
+
+    # One bulk lookup for the whole batch instead of a query per document
+    try:
+        cached_results = cache.get_many(list(by_hash))
+    except Exception as e:
+        print(f"Cache lookup failed for {len(by_hash)} documents: {e}")
+        cached_results = {}
+
+    futures = {}
+    for file_hash, entry in by_hash.items():
+        cached_result = cached_results.get(file_hash)
+        if cached_result:
+            for file_name in entry['names']:
+                yield item_line(file_name, file_hash, cached_result, cached=True)
+            continue
+        try:
+            future = executor.submit(process_item, entry['names'][0], entry.pop('content'))
+        except BrokenProcessPool as e:
+            # A worker crash in a concurrent batch broke the pool; the rest
+            # of this batch goes to the fresh one
+            reset_executor(executor)
+            if shared:
+                executor = get_executor()
+            for file_name in entry['names']:
+                yield item_line(file_name, file_hash, {'error': f'Worker failed: {e}', 'status': 500})
+            continue
+        futures[future] = file_hash
+
+    # New results are written to the cache CACHE_WRITE_BATCH at a time, and
+    # whatever is left once the batch ends (or the client goes away)
+    pending_writes = []
+
+    def flush_writes():
+        if not pending_writes:
+            return
+        try:
+            cache.put_many(pending_writes)
+        except Exception as e:
+            print(f"Cache write failed for {len(pending_writes)} documents: {e}")
+        pending_writes.clear()
+
+    try:
+        for future in as_completed(futures):
+            file_hash = futures[future]
+            try:
+                outcome = future.result()
+            except BrokenProcessPool as e:
+                reset_executor(executor)
+                outcome = {'error': f'Worker failed: {e}', 'status': 500}
+            except Exception as e:
+                outcome = {'error': f'Worker failed: {e}', 'status': 500}
+            if 'error' not in outcome:
+                pending_writes.append((file_hash, outcome['file_name'], outcome['result']))
+                if len(pending_writes) >= CACHE_WRITE_BATCH:
+                    flush_writes()
+            for file_name in by_hash[file_hash]['names']:
+                yield item_line(file_name, file_hash, outcome)
+    finally:
+        flush_writes()
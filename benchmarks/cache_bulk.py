@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from result_cache import LocalCache, ResultCache, SQLiteBackend
+
+
+def sample_result(i):
+    return {
+        'Document Type': 'P', 'Country Code': 'IND', 'Passport Number': f'Z{i:07d}',
+        'Surname': 'SAMPLE', 'Given Name': f'PERSON {i}', 'Place of Birth': 'MUMBAI',
+    }
+
+def fresh_cache(directory):
+    # No local tier, so every lookup reaches the backend
+    backend = SQLiteBackend(os.path.join(directory, f'{uuid.uuid4().hex}.sqlite3'))
+    cache = ResultCache(backend, local=LocalCache(max_entries=0))
+    cache.initialize()
+    return cache
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-row vs bulk file_cache reads and writes (SQLite stand-in)")
+    parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--output', help="Write the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            items = [(uuid.uuid4().hex, f'doc_{i}.jpg', sample_result(i)) for i in range(rows)]
+            hashes = [file_hash for file_hash, _, _ in items]
+
+            single = fresh_cache(directory)
+            bulk = fresh_cache(directory)
+            result = {
+                'rows': rows,
+                'put_seconds': timed(lambda: [single.put(*item) for item in items]),
+                'put_many_seconds': timed(lambda: bulk.put_many(items)),
+                'get_seconds': timed(lambda: [single.get(file_hash) for file_hash in hashes]),
+                'get_many_seconds': timed(lambda: bulk.get_many(hashes)),
+            }
+            path = os.path.join(directory, 'export.jsonl.gz')
+            result['export_seconds'] = timed(lambda: bulk.export(path))
+            result['import_seconds'] = timed(lambda: fresh_cache(directory).import_(path))
+            results.append(result)
+
+    for r in results:
+        print(f"{r['rows']:6d} rows  put {r['put_seconds']:7.3f}s  put_many {r['put_many_seconds']:7.3f}s  "
+              f"get {r['get_seconds']:7.3f}s  get_many {r['get_many_seconds']:7.3f}s  "
+              f"export {r['export_seconds']:7.3f}s  import {r['import_seconds']:7.3f}s")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
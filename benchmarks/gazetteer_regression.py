@@ -0,0 +1,109 @@
+import argparse
+import json
+import random
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from indian_cities.dj_city import cities
+import city_extraction
+from city_extraction import partial_city_match, calculate_match_score, is_excluded_city, find_exact_match
+
+
+# The full-scan implementations that the gazetteer index replaced; kept here
+# as the reference the indexed lookups must agree with.
+def legacy_find_best_match(word, start_index, end_index, words):
+    nearby_words = ' '.join(words[max(0, start_index-12):min(len(words), end_index+15)])
+    best_match = {"city": None, "state": None, "score": 0, "position": start_index}
+    for state, city_list in cities:
+        for city_tuple in city_list:
+            city_name = city_tuple[0].lower()
+            if not is_excluded_city(city_name) and partial_city_match(word, city_name):
+                score = calculate_match_score(word, city_name, nearby_words)
+                if score > best_match["score"]:
+                    best_match = {"city": city_tuple[0], "state": state, "score": score, "position": start_index}
+    return best_match
+
+def legacy_exact_match(word):
+    for state, city_list in cities:
+        exact_match = find_exact_match(word, city_list)
+        if exact_match:
+            return exact_match, state
+    return None
+
+def legacy_states(word):
+    detected_states = []
+    for state, city_list in cities:
+        state_lower = state.lower()
+        if word.lower() == state_lower or (state_lower.endswith(' pradesh') and word.lower() == state_lower.split()[0]):
+            detected_states.append(state)
+    return detected_states
+
+def perturb(word, rng):
+    chars = list(word)
+    op = rng.randrange(4)
+    i = rng.randrange(len(chars))
+    if op == 0:
+        chars[i] = rng.choice('abcdefghijklmnopqrstuvwxyz0<')
+    elif op == 1 and len(chars) > 3:
+        del chars[i]
+    elif op == 2:
+        chars.insert(i, rng.choice('abcdefghijklmnopqrstuvwxyz'))
+    else:
+        start = rng.randrange(max(1, len(chars) - 3))
+        chars = chars[start:start + rng.randint(3, 8)]
+    return ''.join(chars)
+
+def build_corpus(size, seed):
+    rng = random.Random(seed)
+    names = [city_tuple[0].lower() for _, city_list in cities for city_tuple in city_list]
+    names += [state.lower() for state, _ in cities]
+    words = []
+    for _ in range(size):
+        word = rng.choice(names).split()[0]
+        words.append(word if rng.random() < 0.3 else perturb(word, rng))
+    return [w for w in words if len(w) >= 3]
+
+def main():
+    parser = argparse.ArgumentParser(description="Check indexed gazetteer lookups against the full-scan reference")
+    parser.add_argument('--corpus', help="File with one OCR token per line; defaults to perturbed gazetteer names")
+    parser.add_argument('--size', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus, encoding='utf-8') as f:
+            words = [line.strip().lower() for line in f if len(line.strip()) >= 3]
+    else:
+        words = build_corpus(args.size, args.seed)
+
+    gazetteer = city_extraction.get_gazetteer()
+    mismatches = []
+    legacy_time = indexed_time = 0.0
+    for i, word in enumerate(words):
+        start, end = max(0, i - 12), min(len(words), i + 15)
+
+        t0 = time.perf_counter()
+        expected = (legacy_exact_match(word), legacy_states(word), legacy_find_best_match(word, start, end, words))
+        t1 = time.perf_counter()
+        actual = (gazetteer.exact_match(word), gazetteer.states_for(word), city_extraction.find_best_match(word, start, end, words))
+        t2 = time.perf_counter()
+
+        legacy_time += t1 - t0
+        indexed_time += t2 - t1
+        if expected != actual:
+            mismatches.append({'word': word, 'expected': repr(expected), 'actual': repr(actual)})
+
+    print(json.dumps({
+        'words': len(words),
+        'mismatches': len(mismatches),
+        'legacy_seconds': legacy_time,
+        'indexed_seconds': indexed_time,
+        'examples': mismatches[:10],
+    }, indent=4))
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
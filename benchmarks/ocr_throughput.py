@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import cv2
+from synthetic import render_passport
+
+
+def document_images(count, width):
+    # Per document: the MRZ band resized like passport_ocr does, and the
+    # field crops field_regions would cut around the face
+    from orientation_detector import detect_face, mrz_band_top
+    from field_regions import field_boxes
+
+    documents = []
+    for seed in range(count):
+        img, _, _ = render_passport(width=width, seed=seed)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        top = mrz_band_top(gray) or int(gray.shape[0] * 0.8)
+        mrz_roi = cv2.resize(gray[top:], (1110, 140))
+        crops = []
+        face_detected, face = detect_face(img)
+        if face_detected:
+            boxes = field_boxes(gray.shape, face, top) or {}
+            crops = [gray[y0:y1, x0:x1] for x0, y0, x1, y1 in boxes.values()]
+        documents.append((mrz_roi, crops))
+    return documents
+
+def run_unbatched(pool, document):
+    # One readtext call per image, as before batching
+    mrz_roi, crops = document
+    with pool.reader() as reader:
+        reader.readtext(mrz_roi, paragraph=False, detail=0)
+    for crop in crops:
+        with pool.reader() as reader:
+            reader.readtext(crop)
+
+def run_batched(batcher, document):
+    mrz_roi, crops = document
+    futures = [batcher.submit(mrz_roi, paragraph=False, detail=0)]
+    futures += [batcher.submit(crop) for crop in crops]
+    for future in futures:
+        future.result()
+
+def measure(fn, documents, concurrency):
+    latencies = []
+
+    def timed_call(document):
+        start = time.perf_counter()
+        fn(document)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed_call, documents))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    images = sum(1 + len(crops) for _, crops in documents)
+    return {
+        'documents': len(documents),
+        'images': images,
+        'seconds': elapsed,
+        'documents_per_s': len(documents) / elapsed,
+        'images_per_s': images / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="MRZ and field crop OCR throughput with and without micro-batching")
+    parser.add_argument('--documents', type=int, default=32)
+    parser.add_argument('--width', type=int, default=1250)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--max-batch', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--max-wait-ms', type=float, default=10)
+    parser.add_argument('--output', help="Write the results as JSON")
+    args = parser.parse_args()
+
+    from ocr_engine import get_reader_pool
+    from ocr_batcher import OCRBatcher
+
+    pool = get_reader_pool()
+    pool.warm_up()
+    documents = document_images(args.documents, args.width)
+    run_unbatched(pool, documents[0])
+
+    results = []
+    for concurrency in args.concurrency:
+        result = measure(lambda d: run_unbatched(pool, d), documents, concurrency)
+        result.update({'mode': 'unbatched', 'concurrency': concurrency})
+        results.append(result)
+        for max_batch in args.max_batch:
+            batcher = OCRBatcher(pool, max_batch=max_batch, max_wait=args.max_wait_ms / 1000)
+            result = measure(lambda d: run_batched(batcher, d), documents, concurrency)
+            result.update({'mode': f'batched(max={max_batch})', 'concurrency': concurrency,
+                           'avg_images_per_call': batcher.stats()['avg_images_per_call']})
+            results.append(result)
+
+    for r in results:
+        print(f"{r['mode']:20s} c={r['concurrency']:<3d} {r['images_per_s']:8.2f} img/s "
+              f"{r['documents_per_s']:7.2f} doc/s  p50 {r['p50_ms']:8.1f} ms  p95 {r['p95_ms']:8.1f} ms")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import cv2
+import numpy as np
+from synthetic import render_passport, render_pdf, encode_jpeg, ddmmyyyy
+from memory import process_memory
+
+WIDTHS = [800, 1250, 2500]
+ROTATIONS = [0, 90, 180, 270]
+
+
+def rss_mb():
+    # Resident set size of this process, or None where /proc is not available
+    usage = process_memory()
+    return usage['rss'] / 2**20 if usage else None
+
+def max_rss_mb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def measure(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    # tracemalloc only sees the Python heap; numpy, OpenCV and torch buffers
+    # show up in the RSS delta instead
+    rss_before = rss_mb()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = rss_mb()
+    timings.sort()
+    return {
+        'repeat': repeat,
+        'mean_ms': statistics.mean(timings) * 1000,
+        'median_ms': statistics.median(timings) * 1000,
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        'min_ms': timings[0] * 1000,
+        'throughput_per_s': len(timings) / sum(timings) if sum(timings) else None,
+        'peak_python_heap_mb': peak / 2**20,
+        'rss_delta_mb': rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+    }
+
+def upright_cases(cases):
+    return [c for c in cases if c['name'].endswith('_r0')]
+
+def build_cases(widths, rotations):
+    cases = []
+    for width in widths:
+        for rotation in rotations:
+            img, identity, mrz = render_passport(width=width, rotation=rotation, seed=width + rotation)
+            cases.append({'name': f"w{width}_r{rotation}", 'img': img, 'identity': identity, 'mrz': mrz})
+    return cases
+
+def image_benchmarks(cases):
+    # (stage, case, callable) triples; heavy imports happen inside each suite
+    # so that a missing model only knocks out the stages that need it
+    from orientation_detector import rotate_bound, rotate_right_angle, detect_face, find_orientation
+    from pdf_extractor import extract_pdf_image
+
+    for case in cases:
+        img = case['img']
+        yield 'rotate_bound', case['name'], lambda img=img: rotate_bound(img, 90)
+        yield 'rotate_right_angle', case['name'], lambda img=img: rotate_right_angle(img, 90)
+        yield 'find_orientation', case['name'], lambda img=img: find_orientation(img)
+
+    for case in upright_cases(cases):
+        img = case['img']
+        pdf_embedded = render_pdf([img], embed=True)
+        pdf_two_pages = render_pdf([img, img], embed=True)
+        pdf_rendered = render_pdf([img], embed=False)
+
+        yield 'jpeg_decode', case['name'], lambda d=encode_jpeg(img): cv2.imdecode(np.frombuffer(d, np.uint8), cv2.IMREAD_COLOR)
+        yield 'detect_face', case['name'], lambda img=img: detect_face(img)
+        yield 'process_pdf_embedded', case['name'], lambda d=pdf_embedded: extract_pdf_image(d)
+        yield 'process_pdf_two_pages', case['name'], lambda d=pdf_two_pages: extract_pdf_image(d)
+        yield 'process_pdf_rendered', case['name'], lambda d=pdf_rendered: extract_pdf_image(d)
+
+def text_benchmarks(cases):
+    from city_extraction import preprocess_text, extract_cities_and_states, extract_places
+    from text_analysis import TextAnalysis
+    from passport_ocr import extract_date_of_issue, read_mrz_image
+    from mrz import read_td3
+
+    def post_process(text, dob, expiry):
+        # What get_data does with the full page text: one tokenization for
+        # both the places and the date of issue
+        analysis = TextAnalysis(text)
+        return extract_places(analysis), analysis.date_of_issue(dob, expiry)
+
+    for case in upright_cases(cases):
+        img = case['img']
+        identity = case['identity']
+        text = (f"REPUBLIC OF INDIA P IND {identity['number']} {identity['surname']} {identity['given_names']} "
+                f"{identity['sex']} {ddmmyyyy(identity['birth'])} Place of Birth {' '.join(identity['place_of_birth'])} "
+                f"Place of Issue {' '.join(identity['place_of_issue'])} Date of Issue {ddmmyyyy(identity['issue'])} "
+                f"Date of Expiry {ddmmyyyy(identity['expiry'])} {case['mrz'][0]} {case['mrz'][1]}")
+        preprocessed = preprocess_text(text)
+        dob, expiry = ddmmyyyy(identity['birth']), ddmmyyyy(identity['expiry'])
+
+        # Typical OCR confusions in the number and dates, fixed via check digits
+        line1, line2 = case['mrz']
+        misread = line2.replace('0', 'O').replace('1', 'I').replace('5', 'S')
+
+        yield 'read_mrz', case['name'], lambda img=img: read_mrz_image(img)
+        yield 'mrz_check_digits', case['name'], lambda a=line1, b=misread: read_td3(a, b)
+        yield 'extract_cities_and_states', case['name'], lambda t=preprocessed: extract_cities_and_states(t)
+        yield 'extract_date_of_issue', case['name'], lambda t=text, d=dob, e=expiry: extract_date_of_issue(t, d, e)
+        yield 'text_post_processing', case['name'], lambda t=text, d=dob, e=expiry: post_process(t, d, e)
+
+def ocr_benchmarks(cases):
+    from document_ocr import DocumentOCR
+    from passport_ocr import get_data, read_mrz_image, roi_to_gray
+    from ocr_engine import get_reader_pool
+    from orientation_detector import detect_face
+    from field_regions import read_field_regions
+
+    for case in upright_cases(cases):
+        img = case['img']
+        face_detected, face = detect_face(img)
+        mrz = read_mrz_image(img)
+        if mrz is not None:
+            roi = cv2.resize(roi_to_gray(mrz.aux['roi']), (1110, 140))
+            def mrz_ocr(roi=roi):
+                with get_reader_pool().reader() as reader:
+                    reader.readtext(roi, paragraph=False, detail=0)
+            yield 'mrz_ocr', case['name'], mrz_ocr
+        yield 'full_page_ocr', case['name'], lambda img=img: DocumentOCR(img).detections
+        if face_detected:
+            yield 'field_region_ocr', case['name'], lambda img=img, face=face: read_field_regions(img, face)
+        yield 'get_data', case['name'], lambda img=img, name=case['name']: get_data(img, image_name=name)
+        yield 'get_data_regions', case['name'], lambda img=img, name=case['name'], face=face: get_data(img, image_name=name, face=face)
+        yield 'get_data_mrz_only', case['name'], lambda img=img, name=case['name']: get_data(img, image_name=name, mrz_only=True)
+
+def run(args):
+    cases = build_cases(args.widths, args.rotations)
+    results = []
+    suites = [image_benchmarks, text_benchmarks]
+    if not args.skip_ocr:
+        suites.append(ocr_benchmarks)
+    for suite in suites:
+        try:
+            benchmarks = list(suite(cases))
+        except Exception as e:
+            results.append({'stage': suite.__name__, 'case': None, 'error': f"{type(e).__name__}: {e}"})
+            continue
+        for stage, case, fn in benchmarks:
+            if args.stages and stage not in args.stages:
+                continue
+            repeat = args.ocr_repeat if suite is ocr_benchmarks else args.repeat
+            try:
+                result = measure(fn, repeat)
+            except Exception as e:
+                result = {'error': f"{type(e).__name__}: {e}"}
+            result.update({'stage': stage, 'case': case})
+            results.append(result)
+            print(f"{stage:28s} {case:12s} " + (f"{result['median_ms']:10.2f} ms" if 'median_ms' in result else result['error']))
+
+    return {
+        'created_at': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'max_rss_mb': max_rss_mb(),
+        'results': results,
+    }
+
+def compare(current, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    base = {(r['stage'], r['case']): r for r in baseline['results'] if 'median_ms' in r}
+    regressions = []
+    for r in current['results']:
+        previous = base.get((r['stage'], r['case']))
+        if previous is None or 'median_ms' not in r:
+            continue
+        change = r['median_ms'] / previous['median_ms'] - 1 if previous['median_ms'] else 0.0
+        if change > threshold:
+            regressions.append({'stage': r['stage'], 'case': r['case'], 'baseline_ms': previous['median_ms'],
+                                'current_ms': r['median_ms'], 'change': change})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage micro-benchmarks on synthetic passports (CPU only, offline)")
+    parser.add_argument('--output', default=f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    parser.add_argument('--compare', help="Baseline JSON from an earlier run")
+    parser.add_argument('--threshold', type=float, default=0.15, help="Median slowdown reported as a regression")
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--ocr-repeat', type=int, default=2)
+    parser.add_argument('--widths', type=int, nargs='+', default=WIDTHS)
+    parser.add_argument('--rotations', type=int, nargs='+', default=ROTATIONS)
+    parser.add_argument('--stages', nargs='+', help="Only run these stages")
+    parser.add_argument('--skip-ocr', action='store_true', help="Skip stages that need the easyocr models")
+    args = parser.parse_args()
+
+    report = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        regressions = compare(report, args.compare, args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r['stage']} {r['case']}: {r['baseline_ms']:.2f} -> {r['current_ms']:.2f} ms (+{r['change']:.0%})")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import random
+import cv2
+import numpy as np
+
+MRZ_WEIGHTS = (7, 3, 1)
+SURNAMES = ['SHARMA', 'VERMA', 'IYER', 'NAIR', 'REDDY', 'PATEL', 'SINGH', 'KUMAR']
+GIVEN_NAMES = ['ANITA', 'RAHUL', 'PRIYA', 'VIKRAM', 'MEERA', 'ARJUN', 'KAVYA', 'ROHAN']
+PLACES = [('PUNE', 'MAHARASHTRA'), ('LUCKNOW', 'UTTAR PRADESH'), ('JAIPUR', 'RAJASTHAN'),
+          ('KOCHI', 'KERALA'), ('BHOPAL', 'MADHYA PRADESH'), ('NAGPUR', 'MAHARASHTRA')]
+
+
+def mrz_char_value(char):
+    if char.isdigit():
+        return int(char)
+    if char == '<':
+        return 0
+    return ord(char) - ord('A') + 10
+
+def mrz_check_digit(field):
+    return str(sum(mrz_char_value(c) * MRZ_WEIGHTS[i % 3] for i, c in enumerate(field)) % 10)
+
+def make_td3_mrz(surname, given_names, number, nationality, dob, sex, expiry, country='IND'):
+    # dob and expiry as YYMMDD strings
+    name = f"{surname}<<{given_names.replace(' ', '<')}"
+    line1 = f"P<{country}{name}"[:44].ljust(44, '<')
+    number = number.ljust(9, '<')
+    personal = ''.ljust(14, '<')
+    line2 = (number + mrz_check_digit(number) + nationality + dob + mrz_check_digit(dob) + sex
+             + expiry + mrz_check_digit(expiry) + personal + mrz_check_digit(personal))
+    composite = line2[0:10] + line2[13:20] + line2[21:43]
+    line2 += mrz_check_digit(composite)
+    return line1, line2
+
+def random_identity(rng):
+    birth_year = rng.randint(1950, 2005)
+    issue_year = rng.randint(2015, 2023)
+    birth = (rng.randint(1, 28), rng.randint(1, 12), birth_year)
+    issue = (rng.randint(1, 28), rng.randint(1, 12), issue_year)
+    expiry = (issue[0], issue[1], issue_year + 10)
+    place_of_birth, place_of_issue = rng.choice(PLACES), rng.choice(PLACES)
+    return {
+        'surname': rng.choice(SURNAMES),
+        'given_names': rng.choice(GIVEN_NAMES),
+        'number': rng.choice('KLMNPRSTUVZ') + ''.join(rng.choice('0123456789') for _ in range(7)),
+        'sex': rng.choice('MF'),
+        'birth': birth,
+        'issue': issue,
+        'expiry': expiry,
+        'place_of_birth': place_of_birth,
+        'place_of_issue': place_of_issue,
+    }
+
+def yymmdd(date):
+    day, month, year = date
+    return f"{year % 100:02d}{month:02d}{day:02d}"
+
+def ddmmyyyy(date):
+    day, month, year = date
+    return f"{day:02d}/{month:02d}/{year}"
+
+def draw_face(img, x, y, w, h):
+    # A shaded, roughly frontal face: skin ellipse, hair, eyes, brows, nose
+    # and mouth. Good enough to give the HOG detector something face-shaped.
+    cv2.rectangle(img, (x, y), (x + w, y + h), (215, 215, 225), -1)
+    cx, cy = x + w // 2, y + int(h * 0.52)
+    fw, fh = int(w * 0.32), int(h * 0.36)
+    cv2.ellipse(img, (cx, cy - int(fh * 0.45)), (int(fw * 1.1), int(fh * 0.75)), 0, 180, 360, (40, 30, 25), -1)
+    cv2.ellipse(img, (cx, cy), (fw, fh), 0, 0, 360, (150, 175, 215), -1)
+    cv2.rectangle(img, (cx - fw // 3, cy + fh - 5), (cx + fw // 3, y + h), (150, 175, 215), -1)
+    cv2.rectangle(img, (x, y + h - h // 8), (x + w, y + h), (90, 60, 40), -1)
+    eye_y = cy - fh // 5
+    for side in (-1, 1):
+        ex = cx + side * fw // 2
+        cv2.ellipse(img, (ex, eye_y), (fw // 5, fh // 12), 0, 0, 360, (245, 245, 245), -1)
+        cv2.circle(img, (ex, eye_y), fh // 14, (40, 30, 20), -1)
+        cv2.line(img, (ex - fw // 5, eye_y - fh // 6), (ex + fw // 5, eye_y - fh // 5), (40, 30, 25), 3)
+    cv2.line(img, (cx, eye_y + fh // 10), (cx - fw // 10, cy + fh // 4), (110, 135, 175), 2)
+    cv2.ellipse(img, (cx, cy + fh // 2), (fw // 3, fh // 10), 0, 0, 180, (80, 80, 160), 3)
+    img[y:y + h, x:x + w] = cv2.GaussianBlur(img[y:y + h, x:x + w], (5, 5), 0)
+
+def put_mono_text(img, text, x, y, advance, scale, thickness):
+    # Fixed-pitch rendering, closer to OCR-B than proportional Hershey text
+    for i, char in enumerate(text):
+        cv2.putText(img, char, (x + i * advance, y), cv2.FONT_HERSHEY_SIMPLEX, scale, (20, 20, 20), thickness, cv2.LINE_AA)
+
+def render_passport(identity=None, width=1250, rotation=0, seed=0):
+    # A BGR data page laid out like an Indian passport (photo left, fields
+    # right, two-line TD3 MRZ at the bottom), rotated by a multiple of 90
+    # degrees counter-clockwise
+    rng = random.Random(seed)
+    identity = identity or random_identity(rng)
+    height = int(width * 0.704)
+    s = width / 1250
+    img = np.full((height, width, 3), (232, 238, 240), dtype=np.uint8)
+    noise = np.random.default_rng(seed).integers(0, 12, size=img.shape, dtype=np.uint8)
+    img = cv2.subtract(img, noise)
+
+    draw_face(img, int(40 * s), int(140 * s), int(290 * s), int(370 * s))
+
+    def label(text, x, y):
+        cv2.putText(img, text, (int(x * s), int(y * s)), cv2.FONT_HERSHEY_SIMPLEX, 0.55 * s, (90, 70, 60), max(1, int(s)), cv2.LINE_AA)
+
+    def value(text, x, y):
+        cv2.putText(img, text, (int(x * s), int(y * s)), cv2.FONT_HERSHEY_SIMPLEX, 0.9 * s, (20, 20, 20), max(1, int(2 * s)), cv2.LINE_AA)
+
+    cv2.putText(img, 'REPUBLIC OF INDIA', (int(420 * s), int(70 * s)), cv2.FONT_HERSHEY_SIMPLEX, 1.2 * s, (60, 40, 120), max(1, int(2 * s)), cv2.LINE_AA)
+    label('Type', 370, 130); value('P', 370, 165)
+    label('Country Code', 480, 130); value('IND', 480, 165)
+    label('Passport No.', 780, 130); value(identity['number'], 780, 165)
+    label('Surname', 370, 210); value(identity['surname'], 370, 245)
+    label('Given Name(s)', 370, 285); value(identity['given_names'], 370, 320)
+    label('Sex', 370, 360); value(identity['sex'], 370, 395)
+    label('Date of Birth', 780, 360); value(ddmmyyyy(identity['birth']), 780, 395)
+    label('Place of Birth', 370, 435); value(', '.join(identity['place_of_birth']), 370, 470)
+    label('Place of Issue', 370, 510); value(', '.join(identity['place_of_issue']), 370, 545)
+    label('Date of Issue', 370, 585); value(ddmmyyyy(identity['issue']), 370, 620)
+    label('Date of Expiry', 780, 585); value(ddmmyyyy(identity['expiry']), 780, 620)
+
+    line1, line2 = make_td3_mrz(identity['surname'], identity['given_names'], identity['number'], 'IND',
+                                yymmdd(identity['birth']), identity['sex'], yymmdd(identity['expiry']))
+    advance = int(26.5 * s)
+    put_mono_text(img, line1, int(40 * s), height - int(75 * s), advance, 0.95 * s, max(1, int(2 * s)))
+    put_mono_text(img, line2, int(40 * s), height - int(25 * s), advance, 0.95 * s, max(1, int(2 * s)))
+
+    if rotation % 360:
+        rotations = {90: cv2.ROTATE_90_COUNTERCLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_CLOCKWISE}
+        img = cv2.rotate(img, rotations[rotation % 360])
+    return img, identity, (line1, line2)
+
+def encode_jpeg(img, quality=90):
+    ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("JPEG encoding failed")
+    return buf.tobytes()
+
+def render_pdf(images, embed=True, strips=8):
+    # One page per image. embed=True stores the JPEG as the page's image
+    # XObject. Otherwise the passport is stored as horizontal strips, the way
+    # some scanners write pages; no strip covers enough of the page to be
+    # taken as the scan, so the page has to be rasterized.
+    import fitz
+    pdf = fitz.open()
+    for img in images:
+        height, width = img.shape[:2]
+        page = pdf.new_page(width=width * 72 / 150, height=height * 72 / 150)
+        if embed:
+            page.insert_image(page.rect, stream=encode_jpeg(img))
+            continue
+        bounds = np.linspace(0, height, strips + 1).astype(int)
+        scale = page.rect.height / height
+        for top, bottom in zip(bounds[:-1], bounds[1:]):
+            rect = fitz.Rect(0, top * scale, page.rect.width, bottom * scale)
+            page.insert_image(rect, stream=encode_jpeg(img[top:bottom]))
+    data = pdf.tobytes()
+    pdf.close()
+    return data
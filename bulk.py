@@ -0,0 +1,247 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from batch import BATCH_WORKERS, CACHE_WRITE_BATCH, init_worker, item_line
+from pipeline import allowed_file
+
+# Completed inputs are fsync'ed to the checkpoint every this many results
+CHECKPOINT_EVERY = 100
+
+
+def iter_directory(root):
+    # Sorted walk so a resumed run sees files in the same order
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if allowed_file(filename):
+                yield os.path.join(dirpath, filename)
+
+def iter_manifest(path):
+    # One path per line, or JSON lines with a "path" key
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                line = json.loads(line)['path']
+            yield line
+
+def iter_inputs(source):
+    if os.path.isdir(source):
+        return iter_directory(source)
+    return iter_manifest(source)
+
+def load_checkpoint(path):
+    done = set()
+    if os.path.exists(path):
+        with open(path) as f:
+            done.update(line.rstrip('\n') for line in f if line.strip())
+    return done
+
+def iter_chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def lookup_cached(paths, cache):
+    # {path: (file_hash, cached_result)} for the paths already in the cache,
+    # with one bulk lookup for the whole chunk. Files that cannot be read
+    # here are left for the worker to report.
+    from resolution import MAX_UPLOAD_BYTES
+
+    hashes = {}
+    for path in paths:
+        try:
+            if os.path.getsize(path) <= MAX_UPLOAD_BYTES:
+                hashes[path] = file_md5(path)
+        except OSError:
+            pass
+    if not hashes:
+        return {}
+    try:
+        cached_results = cache.get_many(list(hashes.values()))
+    except Exception as e:
+        print(f"Cache lookup failed for {len(hashes)} inputs: {e}", file=sys.stderr)
+        return {}
+    return {
+        path: (file_hash, cached_results[file_hash])
+        for path, file_hash in hashes.items() if cached_results.get(file_hash)
+    }
+
+def process_file(path, mrz_only=False):
+    # Runs in a worker: the same steps as POST /upload, reading and hashing
+    # the file here so the parent only ships paths around
+    from batch import process_item
+    from resolution import MAX_UPLOAD_BYTES
+
+    name = os.path.basename(path)
+    try:
+        if os.path.getsize(path) > MAX_UPLOAD_BYTES:
+            return None, {'file_name': name, 'error': f'File exceeds the {MAX_UPLOAD_BYTES} byte limit', 'status': 413}
+        with open(path, 'rb') as f:
+            content = f.read()
+    except OSError as e:
+        return None, {'file_name': name, 'error': str(e), 'status': 404}
+    return hashlib.md5(content).hexdigest(), process_item(name, content, mrz_only)
+
+def make_executor(workers):
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_worker,
+    )
+
+def run(args):
+    checkpoint_path = args.checkpoint or args.output + '.checkpoint'
+    done = load_checkpoint(checkpoint_path)
+    if done:
+        print(f"Resuming: {len(done)} inputs already done", file=sys.stderr)
+    # Cache lookups and writes happen here in the parent, a chunk at a time,
+    # like run_batch does for /upload/batch
+    cache = None
+    if args.cache and not args.mrz_only:
+        from result_cache import get_result_cache
+        cache = get_result_cache()
+        cache.initialize()
+
+    pool = {'executor': make_executor(args.workers)}
+    max_pending = args.workers * 4
+    pending = {}
+    counts = {'ok': 0, 'error': 0, 'cached': 0, 'skipped': 0, 'crashed': 0}
+    started = time.monotonic()
+
+    def replace_executor(broken):
+        # A worker died (e.g. killed for memory) and took the pool with it;
+        # later inputs go to a fresh one
+        if pool['executor'] is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            pool['executor'] = make_executor(args.workers)
+
+    def submit(path):
+        while True:
+            executor = pool['executor']
+            try:
+                return executor.submit(process_file, path, args.mrz_only)
+            except BrokenProcessPool:
+                replace_executor(executor)
+
+    pending_writes = []
+
+    def flush_writes():
+        if not pending_writes:
+            return
+        try:
+            cache.put_many(pending_writes)
+        except Exception as e:
+            print(f"Cache write failed for {len(pending_writes)} inputs: {e}", file=sys.stderr)
+        pending_writes.clear()
+
+    # Results go to the output before their path goes to the checkpoint, so
+    # a crash can repeat a line in the output but never lose one
+    with open(args.output, 'a') as output, open(checkpoint_path, 'a') as checkpoint:
+        def record(path, file_hash, outcome, cached=False):
+            output.write(item_line(path, file_hash, outcome, cached))
+            output.flush()
+            checkpoint.write(path + '\n')
+            failed = 'error' in outcome or isinstance(outcome['result'], str)
+            counts['error' if failed else 'ok'] += 1
+            counts['cached'] += cached
+            finished = counts['ok'] + counts['error']
+            if finished % CHECKPOINT_EVERY == 0:
+                os.fsync(output.fileno())
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+                rate = finished / (time.monotonic() - started)
+                print(f"{finished} done ({counts['error']} errors, {counts['cached']} cached), {rate:.2f}/s", file=sys.stderr)
+
+        def finish(future):
+            path, executor = pending.pop(future)
+            try:
+                file_hash, outcome = future.result()
+            except Exception as e:
+                # Inputs lost to a worker crash are reported but left out of
+                # the checkpoint, so the next run tries them again
+                if isinstance(e, BrokenProcessPool):
+                    replace_executor(executor)
+                output.write(item_line(path, None, {'error': f'Worker failed: {e}', 'status': 500}))
+                output.flush()
+                counts['crashed'] += 1
+                return
+            if cache is not None and 'error' not in outcome:
+                pending_writes.append((file_hash, outcome['file_name'], outcome['result']))
+                if len(pending_writes) >= CACHE_WRITE_BATCH:
+                    flush_writes()
+            record(path, file_hash, outcome)
+
+        def unfinished_inputs():
+            for path in iter_inputs(args.source):
+                if path in done:
+                    counts['skipped'] += 1
+                else:
+                    yield path
+
+        try:
+            for chunk in iter_chunks(unfinished_inputs(), CACHE_WRITE_BATCH):
+                cached_results = lookup_cached(chunk, cache) if cache is not None else {}
+                for path in chunk:
+                    if path in cached_results:
+                        file_hash, cached_result = cached_results[path]
+                        record(path, file_hash, cached_result, cached=True)
+                        continue
+                    while len(pending) >= max_pending:
+                        completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in completed:
+                            finish(future)
+                    future = submit(path)
+                    pending[future] = (path, pool['executor'])
+            while pending:
+                completed, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    finish(future)
+        finally:
+            pool['executor'].shutdown(wait=False, cancel_futures=True)
+            if cache is not None:
+                flush_writes()
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+
+    print(f"Finished: {counts['ok']} ok, {counts['error']} errors, {counts['cached']} from cache, "
+          f"{counts['skipped']} skipped from checkpoint, {counts['crashed']} lost to worker crashes "
+          f"(retried on the next run)", file=sys.stderr)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the passport pipeline over a directory or manifest, writing JSONL")
+    parser.add_argument('source', help="Directory to walk, or a manifest with one path (or {\"path\": ...}) per line")
+    parser.add_argument('--output', default='results.jsonl', help="JSONL results, appended to")
+    parser.add_argument('--checkpoint', help="Completed inputs, one per line (default: OUTPUT.checkpoint)")
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS)
+    parser.add_argument('--cache', action='store_true', help="Look results up in file_cache and store new ones")
+    parser.add_argument('--mrz-only', action='store_true', help="Only read the MRZ fields")
+    args = parser.parse_args()
+
+    run(args)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
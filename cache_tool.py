@@ -0,0 +1,49 @@
+import argparse
+import sys
+import time
+
+from result_cache import get_result_cache
+
+
+def export_cache(args):
+    cache = get_result_cache()
+    start = time.monotonic()
+    count = cache.export(args.path)
+    print(f"Exported {count} rows to {args.path} in {time.monotonic() - start:.1f}s", file=sys.stderr)
+
+def import_cache(args):
+    cache = get_result_cache()
+    cache.initialize()
+    start = time.monotonic()
+    count = cache.import_(args.path, chunk_size=args.chunk_size)
+    print(f"Imported {count} rows from {args.path} in {time.monotonic() - start:.1f}s", file=sys.stderr)
+
+def prune_cache(args):
+    cache = get_result_cache()
+    start = time.monotonic()
+    count = cache.prune(args.days * 86400)
+    print(f"Deleted {count} rows older than {args.days} days in {time.monotonic() - start:.1f}s", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export, import and prune the file_cache table")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help="Write every cached result to a gzipped JSONL file")
+    export.add_argument('path')
+    export.set_defaults(func=export_cache)
+
+    load = commands.add_parser('import', help="Load an export, keeping each row's created_at")
+    load.add_argument('path')
+    load.add_argument('--chunk-size', type=int, default=500, help="Rows per MERGE")
+    load.set_defaults(func=import_cache)
+
+    prune = commands.add_parser('prune', help="Delete results older than --days, in chunks")
+    prune.add_argument('--days', type=float, required=True)
+    prune.set_defaults(func=prune_cache)
+
+    args = parser.parse_args()
+    args.func(args)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,9 @@
 import re
-from indian_cities.dj_city import cities
 from fuzzywuzzy import fuzz
 import cv2
-import easyocr
-from nltk import ngrams
+from document_ocr import DocumentOCR
+from gazetteer import get_gazetteer
+from text_analysis import TextAnalysis
 
 def extract_text_from_image(image_path):
     img = cv2.imread(image_path)
@@ -11,11 +11,7 @@ def extract_text_from_image(image_path):
         print(f"Error loading image {image_path}")
         return ""
     
-    gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    reader = easyocr.Reader(['en'])
-    result = reader.readtext(gray_img)
-    extracted_text = ' '.join([entry[1] for entry in result])
-    return extracted_text
+    return DocumentOCR(img).text
 
 def preprocess_text(text):
     text = text.lower()
@@ -24,7 +20,7 @@ def preprocess_text(text):
     return text
 
 def get_ngrams(text, n):
-    return [''.join(gram) for gram in ngrams(text, n)]
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
 
 def partial_city_match(word, city_name):
     word = word.lower()
@@ -39,10 +35,9 @@ def partial_city_match(word, city_name):
     return False
 
 def is_excluded_city(city_name):
-    excluded_cities = ["anand"] 
-    return city_name.lower() in excluded_cities    
+    return get_gazetteer().is_excluded(city_name)
 
-def calculate_match_score(word, city_name, nearby_words):
+def calculate_match_score(word, city_name, nearby_words, city_grams=None):
     score = 0
     
     if partial_city_match(word, city_name):
@@ -52,7 +47,8 @@ def calculate_match_score(word, city_name, nearby_words):
         score += 20
     
     word_grams = set(get_ngrams(word, 3))
-    city_grams = set(get_ngrams(city_name, 3))
+    if city_grams is None:
+        city_grams = set(get_ngrams(city_name, 3))
     common_grams = word_grams.intersection(city_grams)
     score += len(common_grams) * 5
     
@@ -63,19 +59,10 @@ def calculate_match_score(word, city_name, nearby_words):
     return score
 
 def find_best_match(word, start_index, end_index, words):
-    nearby_words = ' '.join(words[max(0, start_index-12):min(len(words), end_index+15)])
-    best_match = {"city": None, "state": None, "score": 0, "position": start_index}
-    
-    for state, city_list in cities:
-        for city_tuple in city_list:
-            city_name = city_tuple[0].lower()
-            if not is_excluded_city(city_name) and partial_city_match(word, city_name):
-                score = calculate_match_score(word, city_name, nearby_words)
-                
-                if score > best_match["score"]:
-                    best_match = {"city": city_tuple[0], "state": state, "score": score, "position": start_index}
-    
-    return best_match
+    # Context keywords are looked up in an indexed window over words rather
+    # than a joined string; callers with many words should keep one
+    # TextAnalysis instead of calling this per word
+    return TextAnalysis.from_tokens(words).best_match(word, start_index, end_index)
 
 def find_exact_match(word, city_list):
     for city_tuple in city_list:
@@ -84,58 +71,10 @@ def find_exact_match(word, city_list):
     return None
 
 def extract_cities_and_states(text):
-    words = text.split()
-    detected_cities = []
-    detected_states = []
-    exact_matches = []
-    '''
-    print("Debugging: Checking each word for exact city and state match")
-    '''
-    # Skip the first 20 words
-    words_to_check = words[10:]  
-    for i, word in enumerate(words_to_check):
-        if len(word) < 3:  # Skip short words
-            continue
-        '''
-        print(f"Checking word: '{word}'")
-        '''
-        exact_match_found = False
-        for state, city_list in cities:
-            exact_match = find_exact_match(word, city_list)
-            if exact_match:
-                '''
-                print(f"Exact match found: {exact_match}, {state}")
-                '''            
-                exact_matches.append({"city": exact_match, "state": state, "position": i + 17})  # Adjust position accordingly
-                exact_match_found = True
-                break
-        
-        if not exact_match_found:
-            start_index = max(0, i - 12)
-            end_index = min(len(words), i + 15)
-            match = find_best_match(word, start_index, end_index, words)
-            if match["score"] > 80:  
-                '''
-                print(f"Potential partial match found: {match['city']}, {match['state']} (Score: {match['score']})")
-                ''' 
-                detected_cities.append({"city": match['city'], "state": match['state'], "position": i + 17})  # Adjusting position
-        
-        for state, city_list in cities:
-            state_lower = state.lower()
-            if word.lower() == state_lower or (state_lower.endswith(' pradesh') and word.lower() == state_lower.split()[0]):
-                '''
-                print(f"Potential state match found: {state}")
-                '''
-                detected_states.append(state)
-
-    exact_matches.sort(key=lambda x: x["position"])
-    detected_cities.sort(key=lambda x: x["position"])
-    detected_states = list(set(detected_states))  # Remove duplicates
-    '''
-    print(f"Exact matches: {exact_matches}")
-    print(f"Detected cities: {detected_cities}")
-    print(f"Detected states: {detected_states}")
-    '''
+    return extract_places(TextAnalysis(text))
+
+def extract_places(analysis):
+    exact_matches, detected_cities, detected_states = analysis.scan_places()
     places_info = {
         "place_of_birth": None,
         "place_of_issue": None
@@ -156,6 +95,12 @@ def extract_cities_and_states(text):
     
     return places_info
 
+def match_place(text):
+    # The city named in a single field crop, as "City, State", or None
+    place = TextAnalysis(text).best_place()
+    if place is None:
+        return None
+    return format_place(place, [])
 
 def format_place(city_info, detected_states):
     if detected_states:
@@ -2,7 +2,11 @@ import pymssql
 import json
 import time
 import os
+import threading
+from collections import deque
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from metrics import DB_CONNECTIONS
 
 load_dotenv()
 
@@ -10,14 +14,228 @@ SERVER = os.getenv('DB_SERVER')
 DATABASE = os.getenv('DB_NAME')
 USERNAME = os.getenv('DB_USERNAME')
 PASSWORD = os.getenv('DB_PASSWORD')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+DB_POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE', '300'))
+DB_POOL_CHECK_AFTER = float(os.getenv('DB_POOL_CHECK_AFTER', '30'))
+DB_LOGIN_TIMEOUT = int(os.getenv('DB_LOGIN_TIMEOUT', '5'))
+# Rows per statement for bulk file_cache operations; SQL Server takes at most
+# 2100 parameters per statement and 1000 rows per VALUES list
+DB_BULK_CHUNK = int(os.getenv('DB_BULK_CHUNK', '500'))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def ping(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1")
+    cursor.fetchone()
+
+
+class ConnectionPool:
+    # Bounded, thread-safe pool of DB-API connections. Idle connections older
+    # than max_idle are closed, and one that has sat idle for more than
+    # check_after seconds is pinged before being handed out. acquire() waits
+    # at most `timeout` seconds instead of retrying with sleeps on the
+    # request thread.
+    def __init__(self, connect, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 max_idle=DB_POOL_MAX_IDLE, check_after=DB_POOL_CHECK_AFTER,
+                 health_check=ping, error_types=(Exception,)):
+        if max_size < 1:
+            raise ValueError("Connection pool size must be at least 1")
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self._health_check = health_check
+        self._error_types = error_types
+        self._idle = deque()
+        self._open = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'acquired': 0,
+            'created': 0,
+            'reused': 0,
+            'closed_idle': 0,
+            'closed_unhealthy': 0,
+            'closed_error': 0,
+            'timeouts': 0,
+            'connect_failures': 0,
+            'total_wait_seconds': 0.0,
+        }
+
+    def _close(self, conn, reason):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._open -= 1
+            self._stats[reason] += 1
+            self._cond.notify()
+
+    def _evict_idle(self, now):
+        # Called with the lock held; the oldest connections sit at the left
+        expired = []
+        while self._idle and now - self._idle[0][1] > self.max_idle:
+            expired.append(self._idle.popleft()[0])
+        return expired
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        while True:
+            conn = None
+            create = False
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    expired = self._evict_idle(now)
+                    if expired:
+                        break
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._open < self.max_size:
+                        self._open += 1
+                        create = True
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(f"No database connection available after {timeout} seconds")
+                    self._cond.wait(remaining)
+
+            if expired:
+                for old in expired:
+                    self._close(old, 'closed_idle')
+                continue
+
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._open -= 1
+                        self._stats['connect_failures'] += 1
+                        self._cond.notify()
+                    raise
+            elif time.monotonic() - last_used > self.check_after:
+                try:
+                    self._health_check(conn)
+                except Exception:
+                    self._close(conn, 'closed_unhealthy')
+                    continue
+
+            with self._cond:
+                self._stats['created' if create else 'reused'] += 1
+                self._stats['acquired'] += 1
+                self._stats['total_wait_seconds'] += time.monotonic() - start
+            return conn
+
+    def release(self, conn, discard=False):
+        if discard:
+            self._close(conn, 'closed_error')
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except self._error_types:
+            # The connection may be in an unknown state after a driver error
+            self.release(conn, discard=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close_all(self):
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+        for conn in idle:
+            self._close(conn, 'closed_idle')
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'max_size': self.max_size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._open - len(self._idle),
+            })
+        return stats
+
+
+def connect_mssql():
+    try:
+        conn = pymssql.connect(server=SERVER, user=USERNAME, password=PASSWORD, database=DATABASE,
+                               login_timeout=DB_LOGIN_TIMEOUT)
+    except pymssql.Error:
+        DB_CONNECTIONS.inc(outcome='failure')
+        raise
+    DB_CONNECTIONS.inc(outcome='success')
+    return conn
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(connect_mssql, error_types=(pymssql.Error,))
+    return _pool
+
+def configure_pool(connect, **kwargs):
+    # Swap in another connection factory, e.g. a local stand-in database
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+        _pool = ConnectionPool(connect, **kwargs)
+    return _pool
+
+def reset_pool():
+    # Drop the pool without closing anything, in a forked child whose
+    # inherited connections still belong to the parent
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+def pool_stats():
+    return get_pool().stats()
+
+@contextmanager
+def db_session(conn=None):
+    # Reuse the caller's connection if it has one, otherwise borrow from the pool
+    if conn is not None:
+        yield conn
+        return
+    with get_pool().connection() as conn:
+        yield conn
 
 def get_db_connection(retries=5, delay=5):
     for attempt in range(retries):
         try:
             conn = pymssql.connect(server=SERVER, user=USERNAME, password=PASSWORD, database=DATABASE)
-            print("Connection successful")
+            DB_CONNECTIONS.inc(outcome='success')
             return conn
         except pymssql.OperationalError as e:
+            DB_CONNECTIONS.inc(outcome='failure')
             print(f"OperationalError: {e}. Retrying in {delay} seconds...")
             time.sleep(delay)
         except Exception as e:
@@ -40,12 +258,11 @@ def create_table():
     conn.commit()
     conn.close()
 
-def get_cached_result(file_hash):
-    conn = get_db_connection()
-    cursor = conn.cursor(as_dict=True)
-    cursor.execute("SELECT file_name, result FROM file_cache WHERE file_hash = %s", (file_hash,))
-    result = cursor.fetchone()
-    conn.close()
+def get_cached_result(file_hash, conn=None):
+    with db_session(conn) as conn:
+        cursor = conn.cursor(as_dict=True)
+        cursor.execute("SELECT file_name, result FROM file_cache WHERE file_hash = %s", (file_hash,))
+        result = cursor.fetchone()
     if result:
         return {
             'file_name': result['file_name'],
@@ -53,21 +270,209 @@ def get_cached_result(file_hash):
         }
     return None
 
-def cache_result(file_hash, file_name, data):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "MERGE INTO file_cache AS target "
-        "USING (VALUES (%s, %s, %s, GETDATE())) AS source (file_hash, file_name, result, created_at) "
-        "ON target.file_hash = source.file_hash "
-        "WHEN MATCHED THEN "
-        "    UPDATE SET file_name = source.file_name, result = source.result, created_at = source.created_at "
-        "WHEN NOT MATCHED THEN "
-        "    INSERT (file_hash, file_name, result, created_at) VALUES (source.file_hash, source.file_name, source.result, source.created_at);",
-        (file_hash, file_name, json.dumps(data))
-    )
-    conn.commit()
-    conn.close()
+def cache_result(file_hash, file_name, data, conn=None):
+    with db_session(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "MERGE INTO file_cache AS target "
+            "USING (VALUES (%s, %s, %s, GETDATE())) AS source (file_hash, file_name, result, created_at) "
+            "ON target.file_hash = source.file_hash "
+            "WHEN MATCHED THEN "
+            "    UPDATE SET file_name = source.file_name, result = source.result, created_at = source.created_at "
+            "WHEN NOT MATCHED THEN "
+            "    INSERT (file_hash, file_name, result, created_at) VALUES (source.file_hash, source.file_name, source.result, source.created_at);",
+            (file_hash, file_name, json.dumps(data))
+        )
+        conn.commit()
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def format_created_at(value):
+    if value is None or isinstance(value, str):
+        return value
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+def get_cached_results(file_hashes, conn=None, chunk_size=DB_BULK_CHUNK):
+    # {file_hash: {'file_name', 'result'}} for the hashes that are cached,
+    # one SELECT per chunk_size hashes
+    results = {}
+    with db_session(conn) as conn:
+        cursor = conn.cursor(as_dict=True)
+        for chunk in chunked(dict.fromkeys(file_hashes), chunk_size):
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(
+                f"SELECT file_hash, file_name, result FROM file_cache WHERE file_hash IN ({placeholders})",
+                tuple(chunk)
+            )
+            for row in cursor.fetchall():
+                results[row['file_hash']] = {
+                    'file_name': row['file_name'],
+                    'result': json.loads(row['result'])
+                }
+    return results
+
+def cache_rows(rows, conn=None, chunk_size=DB_BULK_CHUNK):
+    # Upserts (file_hash, file_name, result_json, created_at) rows with one
+    # MERGE per chunk; created_at None means now. Returns the rows written.
+    written = 0
+    with db_session(conn) as conn:
+        cursor = conn.cursor()
+        for chunk in chunked(rows, chunk_size):
+            # MERGE rejects a source with the same key twice; the last one wins
+            chunk = list({row[0]: row for row in chunk}.values())
+            values = ', '.join(['(%s, %s, %s, %s)'] * len(chunk))
+            params = []
+            for file_hash, file_name, result, created_at in chunk:
+                params.extend((file_hash, file_name, result, format_created_at(created_at)))
+            cursor.execute(
+                "MERGE INTO file_cache AS target "
+                f"USING (VALUES {values}) AS source (file_hash, file_name, result, created_at) "
+                "ON target.file_hash = source.file_hash "
+                "WHEN MATCHED THEN "
+                "    UPDATE SET file_name = source.file_name, result = source.result, "
+                "    created_at = COALESCE(CONVERT(DATETIME, source.created_at, 120), GETDATE()) "
+                "WHEN NOT MATCHED THEN "
+                "    INSERT (file_hash, file_name, result, created_at) VALUES (source.file_hash, source.file_name, source.result, "
+                "    COALESCE(CONVERT(DATETIME, source.created_at, 120), GETDATE()));",
+                tuple(params)
+            )
+            conn.commit()
+            written += len(chunk)
+    return written
+
+def iter_cache_rows(conn=None, batch_size=DB_BULK_CHUNK * 2):
+    # Streams every file_cache row as (file_hash, file_name, result_json,
+    # created_at), paging by key so no query holds the whole table
+    last_hash = ''
+    with db_session(conn) as conn:
+        cursor = conn.cursor()
+        while True:
+            cursor.execute(
+                "SELECT TOP (%s) file_hash, file_name, result, created_at FROM file_cache "
+                "WHERE file_hash > %s ORDER BY file_hash",
+                (batch_size, last_hash)
+            )
+            rows = cursor.fetchall()
+            for file_hash, file_name, result, created_at in rows:
+                yield file_hash, file_name, result, format_created_at(created_at)
+            if len(rows) < batch_size:
+                return
+            last_hash = rows[-1][0]
+
+def prune_cache(max_age_seconds, conn=None, chunk_size=DB_BULK_CHUNK * 2):
+    # Deletes rows older than max_age_seconds, chunk_size rows per statement
+    # and transaction so the table is never locked for long. Returns the count.
+    deleted = 0
+    with db_session(conn) as conn:
+        cursor = conn.cursor()
+        while True:
+            cursor.execute(
+                "DELETE TOP (%s) FROM file_cache WHERE created_at < DATEADD(second, -%s, GETDATE())",
+                (chunk_size, max_age_seconds)
+            )
+            count = cursor.rowcount
+            conn.commit()
+            deleted += max(count, 0)
+            if count < chunk_size:
+                return deleted
+
+def create_page_hash_table():
+    # Perceptual page hash and MRZ per cached document, for near-duplicate
+    # lookups; page_hash holds the 64-bit hash as a signed BIGINT
+    with db_session() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='file_cache_page_hash' AND xtype='U')
+        CREATE TABLE file_cache_page_hash (
+            file_hash VARCHAR(32) PRIMARY KEY,
+            page_hash BIGINT NOT NULL,
+            mrz NVARCHAR(100),
+            created_at DATETIME DEFAULT GETDATE()
+        )
+        ''')
+        conn.commit()
+
+def cache_page_hash(file_hash, page_hash, mrz, conn=None):
+    with db_session(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "MERGE INTO file_cache_page_hash AS target "
+            "USING (VALUES (%s, %s, %s)) AS source (file_hash, page_hash, mrz) "
+            "ON target.file_hash = source.file_hash "
+            "WHEN MATCHED THEN "
+            "    UPDATE SET page_hash = source.page_hash, mrz = source.mrz, created_at = GETDATE() "
+            "WHEN NOT MATCHED THEN "
+            "    INSERT (file_hash, page_hash, mrz, created_at) VALUES (source.file_hash, source.page_hash, source.mrz, GETDATE());",
+            (file_hash, page_hash, mrz)
+        )
+        conn.commit()
+
+def iter_page_hashes(since=None, conn=None, batch_size=DB_BULK_CHUNK * 2):
+    # Streams (file_hash, page_hash, mrz, created_at) rows, optionally only
+    # those created at or after `since`, paging by key
+    last_hash = ''
+    since = since or '1900-01-01 00:00:00'
+    with db_session(conn) as conn:
+        cursor = conn.cursor()
+        while True:
+            cursor.execute(
+                "SELECT TOP (%s) file_hash, page_hash, mrz, created_at FROM file_cache_page_hash "
+                "WHERE file_hash > %s AND created_at >= CONVERT(DATETIME, %s, 120) ORDER BY file_hash",
+                (batch_size, last_hash, since)
+            )
+            rows = cursor.fetchall()
+            for file_hash, page_hash, mrz, created_at in rows:
+                yield file_hash, page_hash, mrz, format_created_at(created_at)
+            if len(rows) < batch_size:
+                return
+            last_hash = rows[-1][0]
+
+def create_lease_table():
+    with db_session() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='file_cache_lease' AND xtype='U')
+        CREATE TABLE file_cache_lease (
+            file_hash VARCHAR(32) PRIMARY KEY,
+            owner NVARCHAR(255),
+            expires_at DATETIME
+        )
+        ''')
+        conn.commit()
+
+def acquire_lease(file_hash, owner, ttl_seconds, conn=None):
+    # Takes the lease if nobody holds it or the holder's lease has expired;
+    # returns True when `owner` holds it afterwards
+    with db_session(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "MERGE INTO file_cache_lease WITH (HOLDLOCK) AS target "
+            "USING (VALUES (%s, %s)) AS source (file_hash, owner) "
+            "ON target.file_hash = source.file_hash "
+            "WHEN MATCHED AND (target.expires_at < GETDATE() OR target.owner = source.owner) THEN "
+            "    UPDATE SET owner = source.owner, expires_at = DATEADD(second, %s, GETDATE()) "
+            "WHEN NOT MATCHED THEN "
+            "    INSERT (file_hash, owner, expires_at) VALUES (source.file_hash, source.owner, DATEADD(second, %s, GETDATE()));",
+            (file_hash, owner, ttl_seconds, ttl_seconds)
+        )
+        cursor.execute("SELECT owner FROM file_cache_lease WHERE file_hash = %s", (file_hash,))
+        row = cursor.fetchone()
+        conn.commit()
+    return row is not None and row[0] == owner
+
+def release_lease(file_hash, owner, conn=None):
+    with db_session(conn) as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM file_cache_lease WHERE file_hash = %s AND owner = %s", (file_hash, owner))
+        conn.commit()
 
 def initialize_database():
     create_table()
\ No newline at end of file
@@ -0,0 +1,73 @@
+import cv2
+
+from ocr_engine import get_reader_pool
+from metrics import timed
+from resolution import OCR_MAX_SIDE, fit
+
+
+class DocumentOCR:
+    # Full-page OCR for one document, run at most once and shared by the MRZ
+    # fallback, place extraction and date of issue extraction.
+    def __init__(self, image):
+        self.image = image
+        self._detections = None
+
+    @classmethod
+    def from_path(cls, image_path):
+        img = cv2.imread(image_path)
+        if img is None:
+            raise FileNotFoundError(f"Failed to load image at path: {image_path}")
+        return cls(img)
+
+    @property
+    def detections(self):
+        if self._detections is None:
+            if self.image.ndim == 3:
+                gray_img = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+            else:
+                gray_img = self.image
+            # Read at OCR_MAX_SIDE, with boxes mapped back to image coordinates
+            gray_img, scale = fit(gray_img, OCR_MAX_SIDE)
+            with get_reader_pool().reader() as reader, timed('full_page_ocr'):
+                detections = reader.readtext(gray_img)
+            if scale < 1.0:
+                detections = [([[x / scale, y / scale] for x, y in box], text, confidence)
+                              for box, text, confidence in detections]
+            self._detections = detections
+        return self._detections
+
+    @property
+    def boxes(self):
+        return [entry[0] for entry in self.detections]
+
+    @property
+    def texts(self):
+        return [entry[1] for entry in self.detections]
+
+    @property
+    def confidences(self):
+        return [entry[2] for entry in self.detections]
+
+    @property
+    def text(self):
+        return ' '.join(self.texts)
+
+    def text_lines(self, min_ratio=1.2, confidence_threshold=0.01):
+        output = []
+        for coordinates, text, confidence in self.detections:
+            bbox_width = abs(coordinates[0][0] - coordinates[2][0])
+            bbox_height = abs(coordinates[0][1] - coordinates[2][1])
+            ratio = bbox_width / bbox_height
+
+            if ratio < min_ratio:
+                continue
+
+            if confidence < confidence_threshold:
+                continue
+
+            output.append({
+                "text": text.lower(),
+                "confidence": confidence,
+            })
+
+        return output
@@ -0,0 +1,71 @@
+import cv2
+
+from ocr_batcher import readtext_many
+from orientation_detector import mrz_band_top
+from resolution import MRZ_MAX_SIDE, fit, to_original
+from metrics import timed
+
+# Where the label and value of each field sit on an Indian passport data
+# page: (top, bottom) as fractions of the distance from the top of the face
+# box to the top of the MRZ, and (left, right) as fractions of the distance
+# from the right edge of the photo to the right edge of the page
+FIELD_LAYOUT = {
+    'place_of_birth': (0.28, 0.44, 0.0, 0.65),
+    'place_of_issue': (0.44, 0.60, 0.0, 0.65),
+    'date_of_issue': (0.59, 0.75, 0.0, 0.45),
+}
+# The photo reaches about this many face widths past the face box
+PHOTO_MARGIN = 0.4
+
+
+def field_boxes(image_shape, face, mrz_top, layout=FIELD_LAYOUT):
+    # {field: (x0, y0, x1, y1)} in image pixels, or None when the face and
+    # the MRZ do not frame a plausible field block
+    height, width = image_shape[:2]
+    top = max(0, face.top())
+    left = min(width, int(face.right() + PHOTO_MARGIN * (face.right() - face.left())))
+    span_y = mrz_top - top
+    span_x = width - left
+    if span_y <= 0 or span_x <= 0:
+        return None
+    boxes = {}
+    for name, (y0, y1, x0, x1) in layout.items():
+        box = (left + int(x0 * span_x), top + int(y0 * span_y),
+               left + int(x1 * span_x), top + int(y1 * span_y))
+        if box[2] - box[0] < 8 or box[3] - box[1] < 8:
+            return None
+        boxes[name] = box
+    return boxes
+
+def crop_text(detections):
+    # Reading order: coarse line bands first, then left to right
+    words = []
+    for coordinates, text, confidence in detections:
+        center_y = sum(point[1] for point in coordinates) / len(coordinates)
+        center_x = sum(point[0] for point in coordinates) / len(coordinates)
+        words.append((int(center_y // 16), center_x, text))
+    return ' '.join(text for _, _, text in sorted(words))
+
+def read_field_regions(image, face):
+    # OCR text of each FIELD_LAYOUT crop. The crops are stacked and read in
+    # one readtext call (shared with other requests' crops when OCR batching
+    # is on) instead of reading the whole page. None when the layout cannot
+    # be located (no face box or no MRZ band).
+    if face is None:
+        return None
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    # The band is found on a reduced copy; the crops come from full resolution
+    small, scale = fit(gray, MRZ_MAX_SIDE)
+    mrz_top = mrz_band_top(small)
+    if mrz_top is None:
+        return None
+    mrz_top = to_original(mrz_top, scale)
+    boxes = field_boxes(gray.shape, face, mrz_top)
+    if boxes is None:
+        return None
+
+    names = list(boxes)
+    crops = [gray[y0:y1, x0:x1] for x0, y0, x1, y1 in boxes.values()]
+    with timed('field_ocr'):
+        results = readtext_many(crops)
+    return {name: crop_text(detections) for name, detections in zip(names, results)}
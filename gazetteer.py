@@ -0,0 +1,353 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+from collections import defaultdict
+import numpy as np
+
+EXCLUDED_CITIES = ["anand"]
+NGRAM_SIZE = 3
+SNAPSHOT_PATH = os.getenv('GAZETTEER_SNAPSHOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gazetteer.bin'))
+SNAPSHOT_MAGIC = b'GAZSNAP1'
+SNAPSHOT_VERSION = 3
+
+
+def trigrams(text):
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+def name_key(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def gram_key(gram):
+    # Three code points (21 bits each) packed into one 64-bit key
+    return (ord(gram[0]) << 42) | (ord(gram[1]) << 21) | ord(gram[2])
+
+def key_gram(key):
+    return chr((key >> 42) & 0x1FFFFF) + chr((key >> 21) & 0x1FFFFF) + chr(key & 0x1FFFFF)
+
+def source_fingerprint(city_data, excluded=EXCLUDED_CITIES):
+    # Digest of everything the tables are built from, stored in the snapshot
+    # header so one built from other indian_cities data, exclusions or
+    # trigram size is never used in place of the installed gazetteer
+    source = json.dumps({
+        'version': SNAPSHOT_VERSION,
+        'ngram_size': NGRAM_SIZE,
+        'excluded': sorted(name.lower() for name in excluded),
+        'cities': city_data,
+    }, ensure_ascii=False)
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+def installed_source_stamp(excluded=EXCLUDED_CITIES):
+    # Cheap stand-in for source_fingerprint of the installed indian_cities:
+    # its version and the size and mtime of its data module, found without
+    # importing the data. Checked on every load instead of hashing it all.
+    import importlib.metadata
+    import importlib.util
+    spec = importlib.util.find_spec('indian_cities.dj_city')
+    if spec is None or not spec.origin:
+        return None
+    try:
+        version = importlib.metadata.version('indian-cities')
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+    stat = os.stat(spec.origin)
+    stamp = json.dumps({
+        'version': SNAPSHOT_VERSION,
+        'ngram_size': NGRAM_SIZE,
+        'excluded': sorted(name.lower() for name in excluded),
+        'package': version,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+    })
+    return hashlib.sha256(stamp.encode('utf-8')).hexdigest()
+
+
+class Gazetteer:
+    # Lookup tables over indian_cities built once per process:
+    #  - exact: lower-cased city name -> first entry in gazetteer order
+    #  - state_aliases: "uttar pradesh" and its "uttar" shortcut -> states
+    #  - trigram_index: character trigram -> ids of the cities containing it
+    # A city can only pass partial_city_match if it is a short name or shares
+    # at least one trigram with the word, so fuzzy scoring only needs to look
+    # at the union of the word's trigram postings.
+    def __init__(self, city_data, excluded=EXCLUDED_CITIES):
+        self.excluded = frozenset(name.lower() for name in excluded)
+        self.entries = []
+        self.entry_grams = []
+        self.exact = {}
+        self.state_aliases = defaultdict(list)
+        self.trigram_index = defaultdict(list)
+        self.short_entries = []
+
+        for state, city_list in city_data:
+            state_lower = state.lower()
+            self.state_aliases[state_lower].append(state)
+            if state_lower.endswith(' pradesh'):
+                self.state_aliases[state_lower.split()[0]].append(state)
+
+            for city_tuple in city_list:
+                city = city_tuple[0]
+                city_lower = city.lower()
+                if city_lower in self.excluded:
+                    continue
+                entry_id = len(self.entries)
+                grams = frozenset(trigrams(city_lower))
+                self.entries.append((entry_id, city, state, city_lower))
+                self.entry_grams.append(grams)
+                self.exact.setdefault(city_lower, entry_id)
+                if len(city_lower) < NGRAM_SIZE:
+                    self.short_entries.append(entry_id)
+                for gram in grams:
+                    self.trigram_index[gram].append(entry_id)
+
+    def is_excluded(self, city_name):
+        return city_name.lower() in self.excluded
+
+    def exact_match(self, word):
+        entry_id = self.exact.get(word.lower())
+        if entry_id is None:
+            return None
+        return self.entries[entry_id][1:3]
+
+    def states_for(self, word):
+        return self.state_aliases.get(word.lower(), [])
+
+    def grams(self, entry_id):
+        return self.entry_grams[entry_id]
+
+    def fuzzy_candidates(self, word):
+        word = word.lower()
+        if len(word) < NGRAM_SIZE:
+            return self.entries
+        ids = set(self.short_entries)
+        for gram in trigrams(word):
+            ids.update(self.trigram_index.get(gram, ()))
+        # Keep gazetteer order so ties resolve exactly as a full scan would
+        return [self.entries[i] for i in sorted(ids)]
+
+
+class SnapshotGazetteer:
+    # Read-only view over a file written by build_snapshot. All tables are
+    # numpy arrays over one shared mmap, so worker processes share the pages
+    # instead of each building their own dicts.
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a gazetteer snapshot")
+        header_start = len(SNAPSHOT_MAGIC) + 4
+        header_len = int.from_bytes(self._mm[len(SNAPSHOT_MAGIC):header_start], 'little')
+        header = json.loads(self._mm[header_start:header_start + header_len])
+        if header['version'] != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported gazetteer snapshot version {header['version']}")
+
+        self.path = path
+        self.source = header['source']
+        self.source_stamp = header['source_stamp']
+        self.excluded = frozenset(header['excluded'])
+        self._strings_offset = header['strings_offset']
+        self._tables = {
+            name: np.frombuffer(self._mm, dtype=np.dtype(dtype), count=count, offset=offset)
+            for name, (offset, dtype, count) in header['tables'].items()
+        }
+        self._entries = self._tables['entries'].reshape(-1, 3)
+        self.entry_count = len(self._entries)
+
+    def memory_region(self):
+        # (address, size) of the mapped snapshot, for memory reports
+        return np.frombuffer(self._mm, dtype=np.uint8).ctypes.data, len(self._mm)
+
+    def _string(self, string_id):
+        offsets = self._tables['string_offsets']
+        start = self._strings_offset + int(offsets[string_id])
+        end = self._strings_offset + int(offsets[string_id + 1])
+        return self._mm[start:end].decode('utf-8')
+
+    def _entry(self, entry_id):
+        city_id, state_id, lower_id = self._entries[entry_id]
+        return (int(entry_id), self._string(city_id), self._string(state_id), self._string(lower_id))
+
+    def _find_key(self, keys_table, names_table, text):
+        keys = self._tables[keys_table]
+        key = np.uint64(name_key(text))
+        i = int(np.searchsorted(keys, key))
+        while i < len(keys) and keys[i] == key:
+            if self._string(self._tables[names_table][i]) == text:
+                return i
+            i += 1
+        return None
+
+    @property
+    def entries(self):
+        return [self._entry(i) for i in range(self.entry_count)]
+
+    def is_excluded(self, city_name):
+        return city_name.lower() in self.excluded
+
+    def exact_match(self, word):
+        i = self._find_key('exact_keys', 'exact_names', word.lower())
+        if i is None:
+            return None
+        return self._entry(self._tables['exact_entries'][i])[1:3]
+
+    def states_for(self, word):
+        i = self._find_key('alias_keys', 'alias_names', word.lower())
+        if i is None:
+            return []
+        offsets = self._tables['alias_offsets']
+        states = self._tables['alias_states'][offsets[i]:offsets[i + 1]]
+        return [self._string(state_id) for state_id in states]
+
+    def grams(self, entry_id):
+        offsets = self._tables['entry_gram_offsets']
+        keys = self._tables['entry_gram_keys'][offsets[entry_id]:offsets[entry_id + 1]]
+        return frozenset(key_gram(int(key)) for key in keys)
+
+    def fuzzy_candidates(self, word):
+        word = word.lower()
+        if len(word) < NGRAM_SIZE:
+            return self.entries
+        gram_keys = self._tables['gram_keys']
+        offsets = self._tables['posting_offsets']
+        postings = self._tables['postings']
+        parts = [self._tables['short_entries']]
+        for gram in trigrams(word):
+            key = np.uint64(gram_key(gram))
+            i = int(np.searchsorted(gram_keys, key))
+            if i < len(gram_keys) and gram_keys[i] == key:
+                parts.append(postings[offsets[i]:offsets[i + 1]])
+        ids = np.unique(np.concatenate(parts))
+        return [self._entry(i) for i in ids]
+
+
+def build_snapshot(path=SNAPSHOT_PATH, city_data=None, excluded=EXCLUDED_CITIES):
+    # Snapshots of other data than the installed indian_cities get no stamp,
+    # so get_gazetteer never picks them up
+    source_stamp = None
+    if city_data is None:
+        from indian_cities.dj_city import cities as city_data
+        source_stamp = installed_source_stamp(excluded)
+    gazetteer = Gazetteer(city_data, excluded)
+
+    strings = []
+    string_ids = {}
+    def intern(text):
+        if text not in string_ids:
+            string_ids[text] = len(strings)
+            strings.append(text.encode('utf-8'))
+        return string_ids[text]
+
+    entries = [(intern(city), intern(state), intern(city_lower)) for _, city, state, city_lower in gazetteer.entries]
+
+    exact = sorted((name_key(name), intern(name), entry_id) for name, entry_id in gazetteer.exact.items())
+
+    aliases = sorted((name_key(alias), intern(alias), [intern(state) for state in states])
+                     for alias, states in gazetteer.state_aliases.items())
+    alias_offsets = np.cumsum([0] + [len(states) for _, _, states in aliases])
+
+    grams = sorted((gram_key(gram), ids) for gram, ids in gazetteer.trigram_index.items())
+    posting_offsets = np.cumsum([0] + [len(ids) for _, ids in grams])
+
+    entry_gram_keys = [sorted(gram_key(gram) for gram in entry_grams) for entry_grams in gazetteer.entry_grams]
+    entry_gram_offsets = np.cumsum([0] + [len(keys) for keys in entry_gram_keys])
+
+    string_offsets = np.cumsum([0] + [len(s) for s in strings])
+
+    tables = {
+        'string_offsets': np.asarray(string_offsets, dtype=np.uint32),
+        'entries': np.asarray(entries, dtype=np.uint32).reshape(-1),
+        'exact_keys': np.asarray([k for k, _, _ in exact], dtype=np.uint64),
+        'exact_names': np.asarray([n for _, n, _ in exact], dtype=np.uint32),
+        'exact_entries': np.asarray([e for _, _, e in exact], dtype=np.uint32),
+        'alias_keys': np.asarray([k for k, _, _ in aliases], dtype=np.uint64),
+        'alias_names': np.asarray([n for _, n, _ in aliases], dtype=np.uint32),
+        'alias_offsets': np.asarray(alias_offsets, dtype=np.uint32),
+        'alias_states': np.asarray([s for _, _, states in aliases for s in states], dtype=np.uint32),
+        'gram_keys': np.asarray([k for k, _ in grams], dtype=np.uint64),
+        'posting_offsets': np.asarray(posting_offsets, dtype=np.uint32),
+        'postings': np.asarray([i for _, ids in grams for i in ids], dtype=np.uint32),
+        'entry_gram_offsets': np.asarray(entry_gram_offsets, dtype=np.uint32),
+        'entry_gram_keys': np.asarray([k for keys in entry_gram_keys for k in keys], dtype=np.uint64),
+        'short_entries': np.asarray(gazetteer.short_entries, dtype=np.uint32),
+    }
+
+    # Lay out the string blob and the 8-byte aligned tables, then write a
+    # header recording where each one starts. The header is padded to a fixed
+    # size so its own length does not move the offsets it records.
+    header_size = 4096 + 64 * len(tables)
+    position = len(SNAPSHOT_MAGIC) + 4 + header_size
+    strings_offset = position
+    position += int(string_offsets[-1])
+    layout = {}
+    for name, table in tables.items():
+        position += -position % 8
+        layout[name] = [position, table.dtype.str, int(table.size)]
+        position += table.nbytes
+
+    header = json.dumps({
+        'version': SNAPSHOT_VERSION,
+        'source': source_fingerprint(city_data, excluded),
+        'source_stamp': source_stamp,
+        'excluded': sorted(gazetteer.excluded),
+        'strings_offset': strings_offset,
+        'tables': layout,
+    }).encode('utf-8')
+    if len(header) > header_size:
+        raise ValueError("Gazetteer snapshot header does not fit")
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(len(header).to_bytes(4, 'little'))
+        f.write(header.ljust(header_size, b' '))
+        f.write(b''.join(strings))
+        for name, table in tables.items():
+            f.write(b'\0' * (layout[name][0] - f.tell()))
+            f.write(table.tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+_gazetteer = None
+
+
+def load_snapshot(path, excluded=EXCLUDED_CITIES):
+    # The snapshot at path if it was built from the installed indian_cities
+    # data and excluded, else None
+    try:
+        snapshot = SnapshotGazetteer(path)
+    except ValueError as e:
+        print(f"Ignoring gazetteer snapshot: {e}. Rebuild it with \"python gazetteer.py build\"")
+        return None
+    stamp = installed_source_stamp(excluded)
+    if stamp is None or snapshot.source_stamp != stamp:
+        print(f"Ignoring stale gazetteer snapshot {path}: it was built from other city data or exclusions. "
+              f"Rebuild it with \"python gazetteer.py build\"")
+        return None
+    return snapshot
+
+def get_gazetteer():
+    # Use the prebuilt snapshot when one exists and matches the installed
+    # indian_cities data, so workers share its pages; otherwise build the
+    # tables in this process
+    global _gazetteer
+    if _gazetteer is None:
+        snapshot = load_snapshot(SNAPSHOT_PATH) if os.path.exists(SNAPSHOT_PATH) else None
+        if snapshot is None:
+            from indian_cities.dj_city import cities
+            snapshot = Gazetteer(cities)
+        _gazetteer = snapshot
+    return _gazetteer
+
+def loaded_gazetteer():
+    # The gazetteer if this process has loaded it, without loading it
+    return _gazetteer
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compile the city/state gazetteer into a memory-mappable snapshot")
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--output', default=SNAPSHOT_PATH)
+    args = parser.parse_args()
+    print(f"Gazetteer snapshot written to {build_snapshot(args.output)}")
@@ -0,0 +1,18 @@
+# gunicorn -c gunicorn.conf.py "application:create_app()"
+#
+# Preload-then-fork by default: the master loads the models once and the
+# workers share them copy-on-write (see prefork.py). Set WARM_UP=background
+# to have every worker load its own copy instead, e.g. with OCR_USE_GPU=1.
+import os
+
+os.environ.setdefault('WARM_UP', 'preload')
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_WORKERS', '2'))
+threads = int(os.getenv('WEB_THREADS', '4'))
+preload_app = os.environ['WARM_UP'] == 'preload'
+if preload_app:
+    # Tells create_app that workers will be forked from this process
+    os.environ['PREFORK_SERVER'] = '1'
+# A full-page OCR run on a slow node can take well over gunicorn's default 30s
+timeout = int(os.getenv('WEB_TIMEOUT', '120'))
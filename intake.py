@@ -0,0 +1,148 @@
+import base64
+import hashlib
+import io
+import os
+import tempfile
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from resolution import MAX_UPLOAD_BYTES
+
+# Digests computed while an upload streams in. md5 is the file_cache key and
+# always included; add e.g. sha256 to also return a Repr-Digest header.
+INTAKE_DIGESTS = ['md5'] + [name.strip() for name in os.getenv('INTAKE_DIGESTS', '').split(',')
+                            if name.strip() and name.strip() != 'md5']
+# Uploads larger than this are spooled to a temporary file, so a cache hit on
+# a big PDF never holds the whole file in memory
+INTAKE_SPOOL_BYTES = int(os.getenv('INTAKE_SPOOL_BYTES', str(2 * 2**20)))
+# Header names for digests sent back to the client (RFC 9530)
+DIGEST_HEADER_NAMES = {'sha256': 'sha-256', 'sha512': 'sha-512'}
+
+
+class HashingSpool:
+    # Writable and readable file the multipart parser streams one uploaded
+    # file into. Every chunk is hashed and counted as it arrives; it stays in
+    # memory up to spool_bytes and moves to a temporary file beyond that.
+    def __init__(self, max_bytes=MAX_UPLOAD_BYTES, spool_bytes=INTAKE_SPOOL_BYTES, digests=INTAKE_DIGESTS):
+        self.max_bytes = max_bytes
+        self.spool_bytes = spool_bytes
+        self.size = 0
+        self._hashes = {name: hashlib.new(name) for name in digests}
+        self._file = io.BytesIO()
+        self._on_disk = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f"Upload exceeds the {self.max_bytes} byte limit")
+        for digest in self._hashes.values():
+            digest.update(data)
+        if not self._on_disk and self.size > self.spool_bytes:
+            spooled = tempfile.TemporaryFile()
+            spooled.write(self._file.getbuffer())
+            self._file = spooled
+            self._on_disk = True
+        return self._file.write(data)
+
+    def hexdigest(self, name='md5'):
+        return self._hashes[name].hexdigest()
+
+    def digests(self):
+        return {name: digest.digest() for name, digest in self._hashes.items()}
+
+    def getvalue(self):
+        if not self._on_disk:
+            return self._file.getvalue()
+        position = self._file.tell()
+        self._file.seek(0)
+        data = self._file.read()
+        self._file.seek(position)
+        return data
+
+    @property
+    def on_disk(self):
+        return self._on_disk
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+def upload_limit(filename, max_document_bytes=None):
+    # Endpoints taking a single document set max_document_bytes to have it
+    # cut off while it streams in; zip archives and batch parts are only held
+    # to the request limit, so batches can report oversized documents per item
+    if max_document_bytes is None or (filename and filename.lower().endswith('.zip')):
+        return current_app.config.get('MAX_CONTENT_LENGTH')
+    return max_document_bytes
+
+
+class IntakeRequest(Request):
+    # Uploaded files are hashed while the body is parsed instead of being
+    # read back afterwards. A view sets max_document_bytes before it first
+    # touches request.files to cap each document at that size.
+    max_document_bytes = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        max_bytes = upload_limit(filename, self.max_document_bytes)
+        if max_bytes is not None and content_length and content_length > max_bytes:
+            raise RequestEntityTooLarge(f"Upload exceeds the {max_bytes} byte limit")
+        return HashingSpool(max_bytes)
+
+
+def upload_hash(file, name='md5'):
+    # Digest of an uploaded file, computed during parsing when it came
+    # through an IntakeRequest
+    if isinstance(file.stream, HashingSpool):
+        return file.stream.hexdigest(name)
+    digest = hashlib.new(name)
+    for chunk in iter(lambda: file.stream.read(1 << 20), b''):
+        digest.update(chunk)
+    file.stream.seek(0)
+    return digest.hexdigest()
+
+def upload_content(content):
+    # Uploads are passed around as their HashingSpool until the pipeline
+    # actually needs the bytes, i.e. only on a cache miss
+    if isinstance(content, HashingSpool):
+        return content.getvalue()
+    return content
+
+def digest_header(file):
+    # Repr-Digest value for the extra digests of an upload, or None
+    if not isinstance(file.stream, HashingSpool):
+        return None
+    values = [f"{DIGEST_HEADER_NAMES.get(name, name)}=:{base64.b64encode(digest).decode()}:"
+              for name, digest in file.stream.digests().items() if name != 'md5']
+    return ', '.join(values) or None
@@ -0,0 +1,148 @@
+import math
+import os
+import queue
+import threading
+import time
+import uuid
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', '32'))
+JOB_RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', '3600'))
+MAX_RETRY_AFTER = 300
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Job queue is full, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, file_name, content, file_hash):
+        self.id = uuid.uuid4().hex
+        self.file_name = file_name
+        self.file_hash = file_hash
+        self.content = content
+        self.status = 'queued'
+        self.response = None
+        self.status_code = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def finish(self, response, status_code):
+        self.response = response
+        self.status_code = status_code
+        self.status = 'done' if status_code < 400 else 'failed'
+        self.finished_at = time.time()
+        self.content = None
+
+    def to_dict(self):
+        job = {
+            'job_id': self.id,
+            'file_name': self.file_name,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if self.response is not None:
+            job['code'] = self.status_code
+            job.update(self.response)
+        return job
+
+
+class JobQueue:
+    # A bounded queue of pipeline jobs drained by a fixed set of worker
+    # threads. submit() never blocks: when the queue is full it raises
+    # QueueFull with a Retry-After estimate instead of letting work pile up.
+    def __init__(self, handler, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE, result_ttl=JOB_RESULT_TTL):
+        self._handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stats = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'total_run_seconds': 0.0}
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.status = 'running'
+            job.started_at = time.time()
+            try:
+                response, status_code = self._handler(job.file_name, job.content, job.file_hash)
+            except Exception as e:
+                response, status_code = {'error': str(e)}, 500
+            job.finish(response, status_code)
+            with self._lock:
+                self._stats['completed' if status_code < 400 else 'failed'] += 1
+                self._stats['total_run_seconds'] += job.finished_at - job.started_at
+            self._queue.task_done()
+
+    def _prune(self, now):
+        # Called with the lock held
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.result_ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def retry_after(self):
+        with self._lock:
+            finished = self._stats['completed'] + self._stats['failed']
+            avg_run = self._stats['total_run_seconds'] / finished if finished else 10.0
+        # Time for the workers to drain the current backlog
+        backlog = self._queue.qsize() / max(1, self.workers)
+        return int(min(MAX_RETRY_AFTER, max(1, math.ceil(backlog * avg_run))))
+
+    def submit(self, file_name, content, file_hash):
+        self.start()
+        job = Job(file_name, content, file_hash)
+        with self._lock:
+            self._prune(time.time())
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+                self._stats['rejected'] += 1
+            raise QueueFull(self.retry_after())
+        with self._lock:
+            self._stats['submitted'] += 1
+        return job
+
+    def add_finished(self, file_name, file_hash, response, status_code):
+        # Record a job that needed no queueing, e.g. a cache hit
+        job = Job(file_name, None, file_hash)
+        job.finish(response, status_code)
+        with self._lock:
+            self._prune(time.time())
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'workers': self.workers,
+                'max_queued': self.max_queued,
+                'queued': self._queue.qsize(),
+                'tracked_jobs': len(self._jobs),
+            })
+        return stats
@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import sys
+
+# Where a mapping's pages count as shared or private, per /proc/<pid>/smaps
+SHARED_FIELDS = ('Shared_Clean', 'Shared_Dirty')
+PRIVATE_FIELDS = ('Private_Clean', 'Private_Dirty')
+
+
+def read_smaps_fields(lines):
+    fields = {}
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 3 and parts[2] == 'kB':
+            fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    return fields
+
+def summarize(fields):
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'shared': sum(fields.get(name, 0) for name in SHARED_FIELDS),
+        'private': sum(fields.get(name, 0) for name in PRIVATE_FIELDS),
+        'swap': fields.get('Swap', 0),
+    }
+
+def process_memory(pid='self'):
+    # rss, pss, shared, private and swap bytes of one process, or None where
+    # /proc is not available (or the process is gone)
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            return summarize(read_smaps_fields(f))
+    except OSError:
+        return None
+
+def mappings(pid='self'):
+    # [(start, end, usage)] for every mapping of the process
+    result = []
+    try:
+        with open(f'/proc/{pid}/smaps') as f:
+            start = end = None
+            lines = []
+            for line in f:
+                head = line.split(maxsplit=1)[0]
+                if '-' in head and not head.endswith(':'):
+                    if start is not None:
+                        result.append((start, end, summarize(read_smaps_fields(lines))))
+                    start, end = (int(part, 16) for part in head.split('-'))
+                    lines = []
+                else:
+                    lines.append(line)
+            if start is not None:
+                result.append((start, end, summarize(read_smaps_fields(lines))))
+    except OSError:
+        return []
+    return result
+
+def region_usage(regions, maps):
+    # Resident, shared and private bytes of a set of (address, size) memory
+    # regions. smaps only reports per mapping, so each mapping's split is
+    # applied to the bytes a region overlaps with it.
+    usage = {'bytes': 0, 'rss': 0, 'shared': 0, 'private': 0}
+    spans = sorted((address, address + size) for address, size in regions if size > 0)
+    merged = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    for start, end in merged:
+        usage['bytes'] += end - start
+        for map_start, map_end, map_usage in maps:
+            overlap = min(end, map_end) - max(start, map_start)
+            if overlap <= 0:
+                continue
+            fraction = overlap / (map_end - map_start)
+            for key in ('rss', 'shared', 'private'):
+                usage[key] += int(map_usage[key] * fraction)
+    return usage
+
+def model_regions():
+    # (address, size) regions per model that is loaded in this process
+    regions = {}
+    from ocr_engine import get_reader_pool
+    pool = get_reader_pool()
+    if pool.stats()['warm']:
+        regions['ocr_readers'] = pool.weight_regions()
+    from gazetteer import loaded_gazetteer
+    gazetteer = loaded_gazetteer()
+    if gazetteer is not None and hasattr(gazetteer, 'memory_region'):
+        regions['gazetteer'] = [gazetteer.memory_region()]
+    return regions
+
+def model_memory(pid='self'):
+    maps = mappings(pid)
+    return {name: region_usage(regions, maps) for name, regions in model_regions().items()}
+
+def child_pids(pid):
+    children = []
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return sorted(set(children))
+
+def server_report(master_pid):
+    # Shared versus private memory of a preforking server's master and each
+    # of its workers. A worker added to the pool costs about its private
+    # bytes; shared pages are paid for once.
+    master = process_memory(master_pid)
+    workers = {}
+    for pid in child_pids(master_pid):
+        usage = process_memory(pid)
+        if usage is not None:
+            workers[pid] = usage
+    private = [usage['private'] for usage in workers.values()]
+    report = {
+        'master': master,
+        'workers': workers,
+        'total_pss': (master['pss'] if master else 0) + sum(usage['pss'] for usage in workers.values()),
+        'avg_worker_private': sum(private) / len(private) if private else 0,
+        'avg_worker_shared': sum(usage['shared'] for usage in workers.values()) / len(workers) if workers else 0,
+    }
+    return report
+
+def model_footprints():
+    # Private bytes each model step adds when loaded into this process
+    from startup import MODEL_STEPS
+    footprints = {}
+    for name, step in MODEL_STEPS:
+        before = process_memory()
+        step()
+        after = process_memory()
+        if before and after:
+            footprints[name] = after['private'] - before['private']
+    return footprints
+
+def mb(value):
+    return f"{value / 2**20:9.1f} MB"
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared and private memory of the server processes and models")
+    parser.add_argument('--pid', type=int, help="Master process of a preforking server (e.g. gunicorn)")
+    parser.add_argument('--models', action='store_true', help="Load each model here and report what it adds")
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    report = {}
+    if args.pid:
+        report['server'] = server_report(args.pid)
+    if args.models:
+        report['model_footprints'] = model_footprints()
+        report['models'] = model_memory()
+    if not report:
+        parser.error("nothing to report, pass --pid and/or --models")
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    server = report.get('server')
+    if server:
+        rows = [('master', args.pid, server['master'])] if server['master'] else []
+        rows += [('worker', pid, usage) for pid, usage in server['workers'].items()]
+        for role, pid, usage in rows:
+            print(f"{role:7s} {pid:>8d}  rss {mb(usage['rss'])}  pss {mb(usage['pss'])}  "
+                  f"shared {mb(usage['shared'])}  private {mb(usage['private'])}")
+        print(f"total pss {mb(server['total_pss'])}, each extra worker about {mb(server['avg_worker_private'])}")
+    for name, size in report.get('model_footprints', {}).items():
+        usage = report['models'].get(name)
+        detail = f"  resident {mb(usage['rss'])}" if usage else ''
+        print(f"model {name:14s} loads {mb(size)}{detail}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (1, 2, 3, 4)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def total(self, **labels):
+        # Sum over every series matching the given labels
+        positions = [(self.labelnames.index(name), value) for name, value in labels.items()]
+        with self._lock:
+            return sum(value for key, value in self._values.items()
+                       if all(key[i] == wanted for i, wanted in positions))
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    labels = _label_text(self.labelnames + ('le',), key + (_number(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _label_text(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_number(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge:
+    # Read at scrape time from a callback returning {label values tuple: value}
+    # (or a bare number when the gauge has no labels)
+    def __init__(self, name, documentation, callback, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self._callback()
+        except Exception:
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_label_text(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'passport_stage_seconds', 'Time spent in each pipeline stage.', ['stage']))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'passport_request_seconds', 'End-to-end request latency by endpoint.', ['endpoint', 'status']))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'passport_cache_lookups_total', 'Result cache lookups by tier and outcome.', ['tier', 'outcome']))
+ROTATION_ATTEMPTS = REGISTRY.register(Histogram(
+    'passport_rotation_attempts', 'Angles tried before a face was found.', ['resolution'], buckets=COUNT_BUCKETS))
+MRZ_PATHS = REGISTRY.register(Counter(
+    'passport_mrz_path_total', 'How the MRZ was read: passporteye ROI, full-page fallback, or not at all.', ['path']))
+DB_CONNECTIONS = REGISTRY.register(Counter(
+    'passport_db_connections_total', 'Database connections opened.', ['outcome']))
+OCR_BATCH_SIZE = REGISTRY.register(Histogram(
+    'passport_ocr_batch_size', 'Images read per batched readtext call.', buckets=BATCH_BUCKETS))
+
+
+def _cache_hit_ratio():
+    # Exact (file hash) lookups only; near-duplicate hits have their own ratio
+    hits = CACHE_LOOKUPS.total(tier='local', outcome='hit') + CACHE_LOOKUPS.total(tier='backend', outcome='hit')
+    total = hits + CACHE_LOOKUPS.total(tier='backend', outcome='miss') + CACHE_LOOKUPS.total(tier='local', outcome='negative_hit')
+    return hits / total if total else 0.0
+
+REGISTRY.register(Gauge('passport_cache_hit_ratio', 'Share of cache lookups answered from the cache.', _cache_hit_ratio))
+
+
+_trace = contextvars.ContextVar('passport_trace', default=None)
+
+
+def start_trace():
+    # Collect (stage, seconds) pairs for the current request
+    trace = []
+    _trace.set(trace)
+    return trace
+
+def end_trace():
+    _trace.set(None)
+
+def record(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((stage, seconds))
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+def server_timing(trace):
+    # Format a trace as a Server-Timing header value (durations in ms)
+    return ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in trace)
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,128 @@
+import itertools
+
+TD3_LENGTH = 44
+WEIGHTS = (7, 3, 1)
+FILLER = '<'
+# How many ambiguous characters in one field may be swapped while looking for
+# a reading that satisfies its check digit
+MAX_SUBSTITUTIONS = 3
+
+# Pairs OCR confuses on OCR-B text, in both directions
+TO_DIGIT = {'O': '0', 'Q': '0', 'D': '0', 'I': '1', 'L': '1', 'Z': '2', 'S': '5', 'G': '6', 'B': '8'}
+# A misread digit can stand for more than one letter; the first is the usual one
+TO_LETTERS = {'0': 'ODQ', '1': 'IL', '2': 'Z', '5': 'S', '6': 'G', '8': 'B'}
+TO_LETTER = {digit: letters[0] for digit, letters in TO_LETTERS.items()}
+
+# Per-character shapes: 'A' letter, '9' digit, '<' filler, 'X' either
+DATE_SHAPE = '999999'
+# Indian passport numbers are one letter followed by seven digits
+PASSPORT_NUMBER_SHAPES = {'IND': 'A9999999<'}
+
+# TD3 line 2: (field, start, end, check digit position, shape)
+TD3_FIELDS = [
+    ('passport_number', 0, 9, 9, None),
+    ('date_of_birth', 13, 19, 19, DATE_SHAPE),
+    ('expiration_date', 21, 27, 27, DATE_SHAPE),
+    ('personal_number', 28, 42, 42, None),
+]
+
+
+def char_value(char):
+    if char.isdigit():
+        return int(char)
+    if 'A' <= char <= 'Z':
+        return ord(char) - ord('A') + 10
+    return 0
+
+def check_digit(field):
+    return str(sum(char_value(c) * WEIGHTS[i % 3] for i, c in enumerate(field)) % 10)
+
+def normalize_line(text):
+    line = ''.join(text.upper().split())
+    return line[:TD3_LENGTH].ljust(TD3_LENGTH, FILLER)
+
+def as_letters(text):
+    return ''.join(TO_LETTER.get(c, c) for c in text)
+
+def alternatives(char, kind='X'):
+    # Readings of one OCR character allowed by its shape, most likely first
+    if kind == '9':
+        return [TO_DIGIT.get(char, char)]
+    if kind == 'A':
+        return list(TO_LETTERS.get(char, char))
+    if kind == FILLER:
+        return [FILLER]
+    if char in TO_DIGIT:
+        return [char, TO_DIGIT[char]]
+    return [char] + list(TO_LETTERS.get(char, ''))
+
+def resolve_field(field, check, shape=None, max_substitutions=MAX_SUBSTITUTIONS):
+    # Returns (field, valid). The field is first forced into its shape, then
+    # if the check digit still disagrees, ambiguous characters are swapped
+    # for their alternatives, fewest swaps first, until one reading checks out.
+    options = [alternatives(char, shape[i] if shape else 'X') for i, char in enumerate(field)]
+    field = ''.join(choices[0] for choices in options)
+    check = '0' if check == FILLER else TO_DIGIT.get(check, check)
+    if not check.isdigit():
+        return field, False
+    if check_digit(field) == check:
+        return field, True
+
+    ambiguous = [i for i, choices in enumerate(options) if len(choices) > 1]
+    for count in range(1, min(max_substitutions, len(ambiguous)) + 1):
+        for positions in itertools.combinations(ambiguous, count):
+            for replacements in itertools.product(*(options[i][1:] for i in positions)):
+                candidate = list(field)
+                for i, char in zip(positions, replacements):
+                    candidate[i] = char
+                candidate = ''.join(candidate)
+                if check_digit(candidate) == check:
+                    return candidate, True
+    return field, False
+
+
+class TD3Result:
+    # Corrected MRZ lines and the outcome of every check digit
+    def __init__(self, line1, line2, checks):
+        self.line1 = line1
+        self.line2 = line2
+        self.checks = checks
+
+    @property
+    def valid(self):
+        return all(self.checks.values())
+
+    def to_dict(self):
+        return {'line1': self.line1, 'line2': self.line2, 'checks': dict(self.checks), 'valid': self.valid}
+
+
+def read_td3(line1, line2):
+    line1, line2 = normalize_line(line1), normalize_line(line2)
+
+    # Line 1 only holds letters and fillers after the document type
+    line1 = line1[:2] + as_letters(line1[2:])
+
+    chars = list(line2)
+    chars[10:13] = as_letters(line2[10:13])
+    issuing_country = line1[2:5]
+    checks = {}
+    for name, start, end, check_at, shape in TD3_FIELDS:
+        if name == 'passport_number':
+            shape = PASSPORT_NUMBER_SHAPES.get(issuing_country)
+        value, valid = resolve_field(''.join(chars[start:end]), chars[check_at], shape)
+        chars[start:end] = value
+        chars[check_at] = TO_DIGIT.get(chars[check_at], chars[check_at])
+        checks[name] = valid
+
+    chars[43] = TO_DIGIT.get(chars[43], chars[43])
+    line2 = ''.join(chars)
+    composite = line2[0:10] + line2[13:20] + line2[21:43]
+    checks['composite'] = check_digit(composite) == line2[43]
+    return TD3Result(line1, line2, checks)
+
+def read_td3_lines(texts):
+    # The first two recognized lines, as OCR returned them, or None
+    texts = [text for text in texts if text.strip()]
+    if len(texts) < 2:
+        return None
+    return read_td3(texts[0], texts[1])
@@ -0,0 +1,236 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from metrics import CACHE_LOOKUPS, timed
+from passport_ocr import get_data, read_mrz
+
+NEAR_DUPLICATES = os.getenv('NEAR_DUPLICATES', '1') == '1'
+# Page hashes at most this many bits apart (of 64) are near-duplicate candidates
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv('NEAR_DUPLICATE_MAX_DISTANCE', '8'))
+# How often page hashes stored by other processes are pulled in, in seconds
+NEAR_DUPLICATE_REFRESH = float(os.getenv('NEAR_DUPLICATE_REFRESH', '60'))
+HASH_SIDE = 8
+DCT_SIDE = 32
+
+
+def page_hash(image):
+    # 64-bit DCT perceptual hash of an upright page: grayscale, area-resampled
+    # to 32x32, then one bit per low-frequency coefficient above their median.
+    # Re-encoding, rescaling and rescanning move few of the bits.
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (DCT_SIDE, DCT_SIDE), interpolation=cv2.INTER_AREA)
+    coefficients = cv2.dct(small.astype(np.float32))[:HASH_SIDE, :HASH_SIDE].flatten()
+    # The DC term only tracks overall brightness
+    bits = coefficients > np.median(coefficients[1:])
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+def mrz_key(mrz_read):
+    # Both MRZ lines, when they pass their check digits
+    if mrz_read is None or not mrz_read.valid:
+        return None
+    return mrz_read.line1 + mrz_read.line2
+
+
+class BKTree:
+    # Burkhard-Keller tree over Hamming distance. Each node holds one hash, a
+    # payload dict for whatever is stored under that hash and its children
+    # keyed by their distance from it, so a search only descends into
+    # children whose distance lies within max_distance of the query's.
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def payload(self, key):
+        # The payload of key's node, adding the node if needed
+        if self._root is None:
+            self._root = (key, {}, {})
+            self.size += 1
+            return self._root[1]
+        node = self._root
+        while True:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                return node[1]
+            child = node[2].get(distance)
+            if child is None:
+                child = node[2][distance] = (key, {}, {})
+                self.size += 1
+                return child[1]
+            node = child
+
+    def search(self, key, max_distance):
+        # [(distance, payload)] for every node within max_distance of key
+        matches = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node_key, payload, children = stack.pop()
+            distance = hamming(key, node_key)
+            if distance <= max_distance:
+                matches.append((distance, payload))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return matches
+
+
+class NearDuplicateIndex:
+    # In-memory BK-tree over the page hashes stored next to file_cache, for
+    # finding re-encoded or rescanned copies of a document that was already
+    # read. A candidate only counts once its MRZ matches character for
+    # character: passports of one layout hash alike, so under each page hash
+    # the documents are kept by MRZ and confirming is a dict lookup.
+    def __init__(self, backend=None, max_distance=NEAR_DUPLICATE_MAX_DISTANCE, refresh_interval=NEAR_DUPLICATE_REFRESH):
+        self._backend = backend
+        self.max_distance = max_distance
+        self.refresh_interval = refresh_interval
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._loaded_until = None
+        self._refresher = None
+        self._stats = {'lookups': 0, 'hits': 0, 'no_candidates': 0, 'mrz_mismatches': 0,
+                       'stale': 0, 'failed': 0, 'unreadable_mrz': 0, 'added': 0}
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            from result_cache import get_result_cache
+            return get_result_cache().backend
+        return self._backend
+
+    def load(self):
+        # The page hash table only exists where the feature is turned on
+        self.backend.initialize_page_hashes()
+        self.refresh()
+        self._start_refresher()
+
+    def refresh(self):
+        # Pulls in page hashes stored since the last refresh (by any process)
+        with self._refresh_lock:
+            rows = list(self.backend.iter_page_hashes(since=self._loaded_until))
+            with self._lock:
+                for file_hash, value, mrz, created_at in rows:
+                    self._tree.payload(value).setdefault(mrz, set()).add(file_hash)
+                    if created_at and (self._loaded_until is None or created_at > self._loaded_until):
+                        self._loaded_until = created_at
+
+    def _start_refresher(self):
+        # Refreshes run on their own thread so a request never waits on them
+        # or borrows a database connection for them
+        with self._lock:
+            if self.refresh_interval <= 0 or self._refresher is not None:
+                return
+            self._refresher = threading.Thread(target=self._refresh_loop, name='near-duplicate-refresh', daemon=True)
+        self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Near-duplicate index refresh failed: {e}")
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def add(self, value, file_hash, mrz, conn=None):
+        self.backend.put_page_hash(file_hash, value, mrz, conn=conn)
+        with self._lock:
+            self._tree.payload(value).setdefault(mrz, set()).add(file_hash)
+            self._stats['added'] += 1
+
+    def find(self, value, mrz, get_cached):
+        # Cached result of the closest near-duplicate with the same MRZ, or None
+        with self._lock:
+            self._stats['lookups'] += 1
+            matches = self._tree.search(value, self.max_distance)
+            candidates = [(distance, sorted(payload[mrz])) for distance, payload in matches if mrz in payload]
+        outcome = 'mrz_mismatches' if matches else 'no_candidates'
+        for distance, file_hashes in sorted(candidates, key=lambda candidate: candidate[0]):
+            for file_hash in file_hashes:
+                cached_result = get_cached(file_hash)
+                if cached_result:
+                    self._count('hits')
+                    CACHE_LOOKUPS.inc(tier='near_duplicate', outcome='hit')
+                    return cached_result
+                # The result was pruned from file_cache
+                outcome = 'stale'
+        self._count(outcome)
+        CACHE_LOOKUPS.inc(tier='near_duplicate', outcome='miss')
+        return None
+
+    def count_unreadable(self):
+        self._count('unreadable_mrz')
+
+    def count_failed_lookup(self):
+        # The lookup itself was counted by find before it failed
+        self._count('failed')
+        CACHE_LOOKUPS.inc(tier='near_duplicate', outcome='miss')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['page_hashes'] = self._tree.size
+        checked = stats['lookups'] + stats['unreadable_mrz']
+        stats['hit_ratio'] = stats['hits'] / checked if checked else 0.0
+        stats['max_distance'] = self.max_distance
+        return stats
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_near_duplicate_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = NearDuplicateIndex()
+    return _index
+
+def near_duplicate_stats():
+    return get_near_duplicate_index().stats()
+
+def read_page(image, image_name, face, file_hash, get_cached, index=None):
+    # get_data for an upright page, answered from a near-duplicate's cached
+    # result when there is one. The MRZ read doubles as the confirmation and
+    # is handed on to get_data on a miss, so a miss costs only the hash.
+    index = index or get_near_duplicate_index()
+    with timed('page_hash'):
+        value = page_hash(image)
+    mrz = read_mrz(image)
+    key = mrz_key(mrz[0])
+    if key is None:
+        index.count_unreadable()
+    else:
+        try:
+            with timed('near_duplicate_lookup'):
+                cached_result = index.find(value, key, get_cached)
+        except Exception as e:
+            # A pool timeout or database error only costs the shortcut
+            print(f"Near-duplicate lookup failed for {file_hash}: {e}")
+            index.count_failed_lookup()
+            cached_result = None
+        if cached_result:
+            return cached_result['result']
+
+    data = get_data(image, image_name=image_name, face=face, mrz=mrz)
+    if key is not None and isinstance(data, dict):
+        try:
+            index.add(value, file_hash, key)
+        except Exception as e:
+            print(f"Page hash write failed for {file_hash}: {e}")
+    return data
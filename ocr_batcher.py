@@ -0,0 +1,233 @@
+import bisect
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+
+from ocr_engine import get_reader_pool
+from metrics import OCR_BATCH_SIZE, record
+
+OCR_BATCH_MAX_SIZE = int(os.getenv('OCR_BATCH_MAX_SIZE', '8'))
+# 0 turns batching off: every call reads its own images right away
+OCR_BATCH_MAX_WAIT = float(os.getenv('OCR_BATCH_MAX_WAIT_MS', '10')) / 1000
+# easyocr shrinks anything taller than its 2560px canvas, so stacks stop there
+OCR_BATCH_CANVAS_SIDE = int(os.getenv('OCR_BATCH_CANVAS_SIDE', '2560'))
+# Text boxes the recognizer scores per forward pass
+OCR_RECOGNIZER_BATCH = int(os.getenv('OCR_RECOGNIZER_BATCH', '16'))
+# White rows between stacked images so the detector never joins two of them
+CANVAS_GAP = 24
+
+
+def to_gray(image):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+def stack_images(images, gap=CANVAS_GAP):
+    # One canvas with the images one above the other, plus the canvas row
+    # range each image occupies
+    width = max(image.shape[1] for image in images)
+    height = sum(image.shape[0] for image in images) + gap * (len(images) - 1)
+    canvas = np.full((height, width), 255, dtype=np.uint8)
+    rows = []
+    y = 0
+    for image in images:
+        canvas[y:y + image.shape[0], :image.shape[1]] = image
+        rows.append((y, y + image.shape[0]))
+        y += image.shape[0] + gap
+    return canvas, rows
+
+def split_detections(detections, rows, detail=1):
+    # Hands each detection on the canvas back to the image it came from, in
+    # that image's coordinates and in the order readtext returned them
+    starts = [y0 for y0, _ in rows]
+    results = [[] for _ in rows]
+    for coordinates, text, confidence in detections:
+        center_y = sum(point[1] for point in coordinates) / len(coordinates)
+        index = bisect.bisect_right(starts, center_y) - 1
+        if index < 0 or center_y >= rows[index][1]:
+            continue
+        y0 = rows[index][0]
+        if detail:
+            results[index].append(([[x, y - y0] for x, y in coordinates], text, confidence))
+        else:
+            results[index].append(text)
+    return results
+
+def read_stacked(reader, images, **kwargs):
+    # readtext over several images at once; returns one result list per image
+    options = dict(kwargs)
+    detail = options.pop('detail', 1)
+    options.setdefault('batch_size', OCR_RECOGNIZER_BATCH)
+    canvas, rows = stack_images([to_gray(image) for image in images])
+    detections = reader.readtext(canvas, detail=1, **options)
+    return split_detections(detections, rows, detail)
+
+
+class OCRRequest:
+    def __init__(self, image, kwargs):
+        self.image = to_gray(image)
+        self.kwargs = kwargs
+        self.key = tuple(sorted(kwargs.items()))
+        self.future = Future()
+        self.submitted_at = time.perf_counter()
+
+
+class OCRBatcher:
+    # Collects readtext requests from concurrent callers for up to max_wait
+    # seconds (or max_batch images), stacks the ones sharing readtext options
+    # into one canvas and reads it with a single call. One worker thread per
+    # pooled reader.
+    def __init__(self, pool=None, max_batch=OCR_BATCH_MAX_SIZE, max_wait=OCR_BATCH_MAX_WAIT,
+                 max_canvas_side=OCR_BATCH_CANVAS_SIDE):
+        self.pool = pool or get_reader_pool()
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_canvas_side = max_canvas_side
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stats = {'requests': 0, 'batches': 0, 'calls': 0}
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.pool.size):
+                thread = threading.Thread(target=self._work, name=f"ocr-batcher-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, image, **kwargs):
+        self.start()
+        request = OCRRequest(image, kwargs)
+        self._queue.put(request)
+        return request.future
+
+    def readtext(self, image, **kwargs):
+        return self.submit(image, **kwargs).result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _chunks(self, requests):
+        # Split a group so no stacked canvas grows past max_canvas_side
+        chunk, height = [], 0
+        for request in requests:
+            added = request.image.shape[0] + (CANVAS_GAP if chunk else 0)
+            if chunk and height + added > self.max_canvas_side:
+                yield chunk
+                chunk, height = [], 0
+                added = request.image.shape[0]
+            chunk.append(request)
+            height += added
+        if chunk:
+            yield chunk
+
+    def _work(self):
+        # Nothing may end this loop: a dead worker would leave every pending
+        # and future request waiting forever
+        while True:
+            batch = []
+            try:
+                batch = self._collect()
+                groups = {}
+                for request in batch:
+                    groups.setdefault(request.key, []).append(request)
+                with self._lock:
+                    self._stats['requests'] += len(batch)
+                    self._stats['batches'] += 1
+                for requests in groups.values():
+                    for chunk in self._chunks(requests):
+                        self._run(chunk)
+            except Exception as e:
+                print(f"OCR batch failed: {e}")
+                error = e
+            else:
+                error = RuntimeError("OCR batch ended without a result")
+            # Whatever the batch left unanswered fails instead of hanging
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(error)
+
+    def _run(self, requests):
+        OCR_BATCH_SIZE.observe(len(requests))
+        started = time.perf_counter()
+        for request in requests:
+            record('ocr_batch_wait', started - request.submitted_at)
+        try:
+            with self.pool.reader() as reader:
+                results = read_stacked(reader, [request.image for request in requests], **requests[0].kwargs)
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            return
+        with self._lock:
+            self._stats['calls'] += 1
+        for request, result in zip(requests, results):
+            request.future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'max_batch': self.max_batch,
+            'max_wait_seconds': self.max_wait,
+            'queued': self._queue.qsize(),
+            'avg_images_per_call': stats['requests'] / stats['calls'] if stats['calls'] else 0.0,
+        })
+        return stats
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = OCRBatcher()
+    return _batcher
+
+def configure_batcher(**kwargs):
+    # Replace the shared batcher; max_wait=0 turns batching off
+    global _batcher
+    with _batcher_lock:
+        _batcher = OCRBatcher(**kwargs)
+    return _batcher
+
+def reset_batcher():
+    # In a forked child: the parent's worker threads did not come along
+    global _batcher, _batcher_lock
+    _batcher = None
+    _batcher_lock = threading.Lock()
+
+def readtext_many(images, **kwargs):
+    # One result list per image. With batching on the images join whatever
+    # other requests are waiting; otherwise they are read in one stacked call.
+    batcher = get_batcher()
+    if batcher.max_wait <= 0:
+        with batcher.pool.reader() as reader:
+            return read_stacked(reader, images, **kwargs)
+    futures = [batcher.submit(image, **kwargs) for image in images]
+    return [future.result() for future in futures]
+
+def batched_readtext(image, **kwargs):
+    return readtext_many([image], **kwargs)[0]
+
+def batcher_stats():
+    return get_batcher().stats()
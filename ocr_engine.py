@@ -0,0 +1,126 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import record
+
+OCR_LANGUAGES = ['en']
+OCR_POOL_SIZE = int(os.getenv('OCR_POOL_SIZE', '2'))
+OCR_USE_GPU = os.getenv('OCR_USE_GPU', '0') == '1'
+
+
+class ReaderPool:
+    # A bounded set of easyocr readers, created up front so no request pays
+    # for loading the detector and recognizer weights. Each reader is handed
+    # to one thread at a time since easyocr.Reader is not safe to share.
+    def __init__(self, size=OCR_POOL_SIZE, languages=OCR_LANGUAGES, gpu=OCR_USE_GPU):
+        if size < 1:
+            raise ValueError("OCR pool size must be at least 1")
+        self.size = size
+        self.languages = list(languages)
+        self.gpu = gpu
+        self._readers = queue.Queue(maxsize=size)
+        self._all_readers = []
+        # Counters and bookkeeping only; loading the readers takes seconds and
+        # must not hold up stats() while it runs
+        self._lock = threading.Lock()
+        self._warm_up_lock = threading.Lock()
+        self._warm = False
+        self._borrows = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._in_use = 0
+
+    def warm_up(self):
+        if self._warm:
+            return
+        with self._warm_up_lock:
+            if self._warm:
+                return
+            # torch and easyocr take seconds to import, so only pay for them
+            # once the readers are actually wanted
+            import easyocr
+            readers = [easyocr.Reader(self.languages, gpu=self.gpu) for _ in range(self.size)]
+            with self._lock:
+                for reader in readers:
+                    self._all_readers.append(reader)
+                    self._readers.put(reader)
+                self._warm = True
+
+    @contextmanager
+    def reader(self, timeout=None):
+        self.warm_up()
+        start = time.perf_counter()
+        try:
+            reader = self._readers.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No OCR reader available after {timeout} seconds")
+        waited = time.perf_counter() - start
+        record('ocr_reader_wait', waited)
+        with self._lock:
+            self._borrows += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+            self._in_use += 1
+        try:
+            yield reader
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._readers.put(reader)
+
+    def readtext(self, image, **kwargs):
+        with self.reader() as reader:
+            return reader.readtext(image, **kwargs)
+
+    def weight_regions(self):
+        # (address, size) of every reader's detector and recognizer weights,
+        # for memory reports
+        regions = []
+        for reader in self._all_readers:
+            for model in (reader.detector, reader.recognizer):
+                for tensor in model.state_dict().values():
+                    regions.append((tensor.data_ptr(), tensor.numel() * tensor.element_size()))
+        return regions
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pool_size': self.size,
+                'warm': self._warm,
+                'in_use': self._in_use,
+                'borrows': self._borrows,
+                'total_wait_seconds': self._total_wait,
+                'avg_wait_seconds': self._total_wait / self._borrows if self._borrows else 0.0,
+                'max_wait_seconds': self._max_wait,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_reader_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ReaderPool()
+    return _pool
+
+
+def configure_reader_pool(size=OCR_POOL_SIZE, **kwargs):
+    # Replace the shared pool, e.g. with a single reader in a worker process
+    global _pool
+    with _pool_lock:
+        _pool = ReaderPool(size, **kwargs)
+    return _pool
+
+def readtext(image, **kwargs):
+    return get_reader_pool().readtext(image, **kwargs)
+
+
+def pool_stats():
+    return get_reader_pool().stats()
@@ -1,9 +1,23 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import dlib
 import cv2
+from metrics import ROTATION_ATTEMPTS, timed
+from resolution import fit
 
-detector = dlib.get_frontal_face_detector()
-predictor = dlib.shape_predictor("shape_predictor_68_face_landmarks.dat")
+_detector = None
+_detector_lock = threading.Lock()
+
+def get_detector():
+    # Built on first use (or during warm-up) rather than at import
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = dlib.get_frontal_face_detector()
+    return _detector
 
 def rotate_bound(image, angle):
     height, width = image.shape[:2]
@@ -24,7 +38,133 @@ def rotate_bound(image, angle):
 
 def detect_face(image):
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    faces = detector(gray)
+    with timed('face_detection'):
+        faces = get_detector()(gray)
     if len(faces) > 0:
         return True, faces[0]  
     return False, None
+
+PROBE_MAX_SIDE = int(os.getenv('ORIENTATION_PROBE_MAX_SIDE', '1024'))
+ROTATIONS = {
+    90: cv2.ROTATE_90_COUNTERCLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_CLOCKWISE,
+}
+# Angle that brings the MRZ band back to the bottom edge of the page
+MRZ_SIDE_ANGLES = {'bottom': 0, 'left': 90, 'top': 180, 'right': 270}
+
+def rotate_right_angle(image, angle):
+    # Same result as rotate_bound for multiples of 90 degrees, but a plain
+    # pixel transpose instead of an interpolated warp
+    angle = angle % 360
+    if angle == 0:
+        return image
+    return cv2.rotate(image, ROTATIONS[angle])
+
+def make_thumbnail(image, max_side=PROBE_MAX_SIDE):
+    return fit(image, max_side)
+
+def mrz_band_coverage(gray):
+    # The MRZ is two lines of dense characters running across almost the whole
+    # page, so after smearing character edges along the text direction its rows
+    # (or columns, if the page is on its side) are far more covered than any
+    # other line of text. Returns the best coverage found near each edge.
+    height, width = gray.shape[:2]
+    grad_x = np.abs(cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3))
+    grad_y = np.abs(cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3))
+    _, edges_x = cv2.threshold(cv2.convertScaleAbs(grad_x), 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    _, edges_y = cv2.threshold(cv2.convertScaleAbs(grad_y), 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    rows = cv2.morphologyEx(edges_x, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, width // 40), 1)))
+    cols = cv2.morphologyEx(edges_y, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(3, height // 40))))
+    row_coverage = rows.mean(axis=1) / 255
+    col_coverage = cols.mean(axis=0) / 255
+
+    third_h = max(1, height // 3)
+    third_w = max(1, width // 3)
+    return {
+        'bottom': float(row_coverage[-third_h:].max()),
+        'top': float(row_coverage[:third_h].max()),
+        'right': float(col_coverage[-third_w:].max()),
+        'left': float(col_coverage[:third_w].max()),
+    }
+
+def mrz_band_top(gray, min_coverage=0.6):
+    # First row of the MRZ band on an upright page (the topmost row in the
+    # bottom third covered like MRZ text is), or None if there is no band
+    height, width = gray.shape[:2]
+    third_h = max(1, height // 3)
+    band = gray[height - third_h:]
+    grad_x = np.abs(cv2.Sobel(band, cv2.CV_32F, 1, 0, ksize=3))
+    _, edges_x = cv2.threshold(cv2.convertScaleAbs(grad_x), 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    rows = cv2.morphologyEx(edges_x, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, width // 40), 1)))
+    covered = np.flatnonzero(rows.mean(axis=1) / 255 >= min_coverage)
+    if covered.size == 0:
+        return None
+    return height - third_h + int(covered[0])
+
+def find_mrz_side(gray, min_coverage=0.5):
+    coverage = mrz_band_coverage(gray)
+    side = max(coverage, key=coverage.get)
+    if coverage[side] < min_coverage:
+        return None
+    return side
+
+def candidate_angles(image):
+    height, width = image.shape[:2]
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    side = find_mrz_side(gray)
+    if height > width:
+        # A data page on its side shows up taller than it is wide
+        order = [0, 90, 270, 180]
+    else:
+        order = [0, 180, 90, 270]
+    if side is not None:
+        order.remove(MRZ_SIDE_ANGLES[side])
+        order.insert(0, MRZ_SIDE_ANGLES[side])
+    return order
+
+def scale_rectangle(rect, scale):
+    return dlib.rectangle(int(round(rect.left() / scale)), int(round(rect.top() / scale)),
+                          int(round(rect.right() / scale)), int(round(rect.bottom() / scale)))
+
+def probe_angles(thumb, angles, parallel=False, resolution='thumbnail'):
+    def probe(angle):
+        with timed('rotation_attempt'):
+            return detect_face(rotate_right_angle(thumb, angle))
+
+    if parallel:
+        with ThreadPoolExecutor(max_workers=len(angles)) as executor:
+            results = list(executor.map(probe, angles))
+        ROTATION_ATTEMPTS.observe(len(angles), resolution=resolution)
+        for angle, (face_detected, face) in zip(angles, results):
+            if face_detected:
+                return angle, face
+        return None, None
+
+    for attempt, angle in enumerate(angles, 1):
+        face_detected, face = probe(angle)
+        if face_detected:
+            ROTATION_ATTEMPTS.observe(attempt, resolution=resolution)
+            return angle, face
+    ROTATION_ATTEMPTS.observe(len(angles), resolution=resolution)
+    return None, None
+
+def find_orientation(image, parallel=False, max_side=PROBE_MAX_SIDE):
+    # Returns (angle, rotated_image, face) with the face box in the rotated
+    # full-resolution image, or (None, None, None) when no angle has a face
+    thumb, scale = make_thumbnail(image, max_side)
+    with timed('orientation_hint'):
+        angles = candidate_angles(thumb)
+    angle, face = probe_angles(thumb, angles, parallel)
+
+    if angle is None and scale < 1.0:
+        # Faces too small to find on the thumbnail: fall back to full resolution
+        angle, face = probe_angles(image, angles, parallel, resolution='full')
+        scale = 1.0
+
+    if angle is None:
+        return None, None, None
+
+    if scale < 1.0:
+        face = scale_rectangle(face, scale)
+    return angle, rotate_right_angle(image, angle), face
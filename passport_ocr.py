@@ -1,20 +1,18 @@
-import os
 import string as st
 from dateutil import parser
-import matplotlib.image as mpimg
 import cv2
-from passporteye import read_mrz
+import numpy as np
 import json
-import easyocr
 import datetime
 import re
-from city_extraction import extract_text_from_image, preprocess_text, extract_cities_and_states
-
-reader = easyocr.Reader(['en'])
-
-def generate_timestamp_filename(prefix='tmp', extension='.png'):
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    return f"{prefix}_{timestamp}{extension}"
+from city_extraction import extract_places, match_place
+from document_ocr import DocumentOCR
+from mrz import read_td3_lines
+from text_analysis import TextAnalysis
+from field_regions import read_field_regions
+from resolution import MRZ_MAX_SIDE, fit
+from ocr_batcher import batched_readtext
+from metrics import MRZ_PATHS, timed
 
 def parse_date(string, is_dob=True):
     date = parser.parse(string, yearfirst=True).date()
@@ -67,14 +65,8 @@ def parse_mrz_lines(line1, line2):
             user_info['surname'] = surname_words[1]
     
     # Line 2
-    passport_number = clean(line2[0:9])
-    
-    if passport_number[0] == '2':
-        passport_number = 'Z' + passport_number[1:]
-    elif passport_number[0] == '5':
-        passport_number = 'S' + passport_number[1:]
-    
-    user_info['passport_number'] = passport_number
+    # Letter/digit confusions are resolved against the check digits by mrz.read_td3
+    user_info['passport_number'] = clean(line2[0:9])
     user_info['nationality'] = get_country_name(clean(line2[10:13]))
     user_info['date_of_birth'] = parse_date(line2[13:19], is_dob=True)
     user_info['gender'] = get_gender(clean(line2[20]))
@@ -84,113 +76,131 @@ def parse_mrz_lines(line1, line2):
 
 
 def extract_date_of_issue(full_text, dob, expiry_date):
-    date_strings = re.findall(r'\d{1,2}\s*/\s*\d{1,2}\s*/\s*\d{2,4}', full_text)
-    cleaned_dates = []
-    for date_str in date_strings:
-        try:
-            date_str_cleaned = re.sub(r'\s+', '', date_str).replace("/", "/ ").strip()
-            components = date_str_cleaned.split('/')
-            
-            if len(components) != 3:
-                continue
-            
-            day = components[0].strip().zfill(2)
-            month = components[1].strip().zfill(2)
-            year = components[2].strip()
-            
-            if len(year) == 3:
-                year = "2" + year
-            elif len(year) == 2:
-                current_year = datetime.datetime.now().year
-                century = str(current_year)[:2]
-                year = f"{century}{year}"
-            
-            date_str_cleaned = f"{day}/{month}/{year}"
-            
-            if re.match(r'\d{2}/\d{2}/\d{4}', date_str_cleaned):
-                cleaned_dates.append(date_str_cleaned)
-        except ValueError:
-            continue
-    
-    dob_date = parser.parse(dob, dayfirst=True).date()
-    expiry_date = parser.parse(expiry_date, dayfirst=True).date()
-    
-    for date_str in cleaned_dates:
-        try:
-            date = parser.parse(date_str, dayfirst=True).date()
-            if date != dob_date and date != expiry_date:
-                return date_str
-        except ValueError:
-            continue
-    
-    return None
-
-def get_data(img_name):
+    return TextAnalysis(full_text).date_of_issue(dob, expiry_date)
+
+def read_mrz_image(img):
+    # Same as passporteye.read_mrz(path, save_roi=True), but fed from a decoded
+    # array instead of a file so nothing has to be written to disk
+    # passporteye pulls in scikit-image, so import it on first use
+    from passporteye.mrz.image import MRZPipeline
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    # The ROI is resized to 1110x140 for OCR anyway, so detection does not
+    # need more than MRZ_MAX_SIDE pixels
+    gray = fit(gray, MRZ_MAX_SIDE)[0]
+    pipeline = MRZPipeline(None)
+    pipeline.replace_component('loader', lambda: gray.astype(np.float64) / 255.0, provides=['img'], depends=[])
+    mrz = pipeline.result
+    if mrz is not None:
+        mrz.aux['text'] = pipeline['text']
+        mrz.aux['roi'] = pipeline['roi']
+    return mrz
+
+def roi_to_gray(roi):
+    # Stretch to the full 8-bit range like matplotlib's imsave(cmap='gray') did
+    return cv2.normalize(roi.astype(np.float32), None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+
+REGION_FIELDS = ('place_of_birth', 'place_of_issue', 'date_of_issue')
+
+def extract_region_fields(image, face, dob, expiry_date):
+    # Place of birth, place of issue and date of issue read from crops around
+    # the fields; whatever cannot be found is left out
+    crops = read_field_regions(image, face)
+    if crops is None:
+        return {}
+    fields = {}
+    with timed('city_matching'):
+        for name in ('place_of_birth', 'place_of_issue'):
+            place = match_place(crops[name])
+            if place:
+                fields[name] = place
+    with timed('date_extraction'):
+        date_of_issue = extract_date_of_issue(crops['date_of_issue'], dob, expiry_date)
+    if date_of_issue:
+        fields['date_of_issue'] = date_of_issue
+    return fields
+
+def read_mrz(image):
+    # (TD3Result or None, DocumentOCR if the full page had to be read to
+    # find the MRZ, else None)
+    document = None
+    mrz_read, path = None, 'unreadable'
+
+    with timed('mrz_detection'):
+        mrz = read_mrz_image(image)
+
+    if mrz:
+        img = cv2.resize(roi_to_gray(mrz.aux['roi']), (1110, 140))
+
+        allowlist = st.ascii_uppercase + st.digits + '< '
+        with timed('mrz_ocr'):
+            code = batched_readtext(img, paragraph=False, detail=0, allowlist=allowlist)
+        mrz_read = read_td3_lines(code)
+        if mrz_read is not None:
+            path = 'passporteye'
+
+    if mrz_read is None or not mrz_read.valid:
+        # Look for the MRZ lines in the full page as well, and prefer them
+        # when the ROI read was missing or failed its check digits
+        document = DocumentOCR(image)
+        ocr_output = document.text_lines()
+        mrz_patterns = [item['text'].upper() for item in ocr_output if '<' in item['text']]
+        fallback = read_td3_lines(mrz_patterns)
+        if fallback is not None and (mrz_read is None or fallback.valid):
+            mrz_read, path = fallback, 'fallback'
+
+    MRZ_PATHS.inc(path=path)
+    return mrz_read, document
+
+def get_data(image, image_name=None, mrz_only=False, face=None, mrz=None):
+    # mrz_only skips place and date of issue extraction, so a document whose
+    # MRZ passes its check digits costs one small ROI OCR call. With the face
+    # box of the upright page, those fields come from targeted crops and the
+    # full page is only read for fields the crops missed. mrz takes the
+    # result of an earlier read_mrz(image).
     user_info = {}
-    new_im_path = generate_timestamp_filename()
-    im_path = img_name
+    if isinstance(image, str):
+        image_name = image_name or image
+        image = load_image(image)
+    mrz_read, document = mrz if mrz is not None else read_mrz(image)
+    if mrz_read is None:
+        return f'Machine cannot read image {image_name}.'
+
+    user_info = parse_mrz_lines(mrz_read.line1, mrz_read.line2)
+    user_info['mrz_valid'] = mrz_read.valid
+    if mrz_only:
+        return user_info
+
+    dob = user_info['date_of_birth']
+    expiry_date = user_info['expiration_date']
+    fields = {}
+    if face is not None and document is None:
+        fields = extract_region_fields(image, face, dob, expiry_date)
+
+    if any(name not in fields for name in REGION_FIELDS):
+        if document is None:
+            document = DocumentOCR(image)
+        full_extracted_text = document.text
+        # Tokenized once for both the place and the date lookups
+        with timed('text_analysis'):
+            analysis = TextAnalysis(full_extracted_text)
+        with timed('city_matching'):
+            places_info = extract_places(analysis)
+        with timed('date_extraction'):
+            date_of_issue = analysis.date_of_issue(dob, expiry_date)
+        full_page_fields = {
+            'place_of_birth': places_info["place_of_birth"],
+            'place_of_issue': places_info["place_of_issue"],
+            'date_of_issue': date_of_issue,
+        }
+        for name, value in full_page_fields.items():
+            if name not in fields and value:
+                fields[name] = value
+
+    user_info['place_of_birth'] = fields.get('place_of_birth') or "Not found"
+    user_info['place_of_issue'] = fields.get('place_of_issue') or "Not found"
+    if fields.get('date_of_issue'):
+        user_info['date_of_issue'] = fields['date_of_issue']
 
-    try:
-        mrz = read_mrz(im_path, save_roi=True)
-
-        if mrz:
-            mpimg.imsave(new_im_path, mrz.aux['roi'], cmap='gray')
-            img = cv2.imread(new_im_path)
-            img = cv2.resize(img, (1110, 140))
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-            allowlist = st.ascii_uppercase + st.digits + '< '
-            code = reader.readtext(img, paragraph=False, detail=0, allowlist=allowlist)
-            a, b = code[0].upper(), code[1].upper()
-
-            if len(a) < 44:
-                a = a + '<' * (44 - len(a))
-            if len(b) < 44:
-                b = b + '<' * (44 - len(b))
-
-            user_info = parse_mrz_lines(a, b)
-            
-            passport_number = user_info['passport_number']
-            if passport_number[0].isdigit():
-                if passport_number[0] == '2':
-                    passport_number = 'Z' + passport_number[1:]
-                elif passport_number[0] == '5':
-                    passport_number = 'S' + passport_number[1:]
-                user_info['passport_number'] = passport_number
-
-        else:
-            ocr_output = read_and_display_text(im_path)
-            mrz_patterns = [item['text'] for item in ocr_output if '<' in item['text']]
-
-            if len(mrz_patterns) >= 2:
-                mrz_line1 = mrz_patterns[0].upper()
-                mrz_line2 = mrz_patterns[1].upper()
-                user_info = parse_mrz_lines(mrz_line1, mrz_line2)
-            else:
-                return f'Machine cannot read image {img_name}.'
-        
-        full_extracted_text = extract_text_from_image(im_path)
-        preprocessed_text = preprocess_text(full_extracted_text)
-        places_info = extract_cities_and_states(preprocessed_text)
-        '''
-        print("Full extracted text:", full_extracted_text)
-        print("Preprocessed text:", preprocessed_text)
-        print("Places info:", places_info)
-        '''
-        user_info['place_of_birth'] = places_info["place_of_birth"] or "Not found"
-        user_info['place_of_issue'] = places_info["place_of_issue"] or "Not found"
-       
-        if 'date_of_birth' in user_info and 'expiration_date' in user_info:
-            dob = user_info['date_of_birth']
-            expiry_date = user_info['expiration_date']
-            date_of_issue = extract_date_of_issue(full_extracted_text, dob, expiry_date)
-            if date_of_issue:
-                user_info['date_of_issue'] = date_of_issue
-
-    finally:
-        if os.path.exists(new_im_path):
-            os.remove(new_im_path)
-    
     return user_info
 
 def load_image(image_path):
@@ -200,34 +210,7 @@ def load_image(image_path):
     return img
 
 def read_and_display_text(image_path):
-    img = load_image(image_path)
-    result = reader.readtext(img)
-    
-    min_ratio = 1.2
-    confidence_threshold = 0.01
-    
-    output = []
-    for detection in result:
-        text = detection[1].lower()
-        confidence = detection[2]
-        coordinates = detection[0]
-
-        bbox_width = abs(coordinates[0][0] - coordinates[2][0])
-        bbox_height = abs(coordinates[0][1] - coordinates[2][1])
-        ratio = bbox_width / bbox_height
-        
-        if ratio < min_ratio:
-            continue
-
-        if confidence < confidence_threshold:
-            continue
-
-        output.append({
-            "text": text,
-            "confidence": confidence,
-        })
-    
-    return output
+    return DocumentOCR(load_image(image_path)).text_lines()
 
 '''
 if __name__ == "__main__":
@@ -1,32 +1,121 @@
 import os
+import uuid
 import fitz
-from datetime import datetime
+import cv2
+import numpy as np
+from orientation_detector import make_thumbnail, mrz_band_coverage
+from resolution import NATIVE_MAX_SIDE, check_pixels, fit
+
+# Pages are rendered so their long side lands near this many pixels
+TARGET_LONG_SIDE = int(os.getenv('PDF_TARGET_LONG_SIDE', '2200'))
+MIN_RENDER_DPI = 100
+MAX_RENDER_DPI = 300
+PROBE_DPI = 36
+# An embedded image is used as-is when it covers this much of its page
+MIN_IMAGE_COVERAGE = 0.5
+MAX_PDF_PAGES = int(os.getenv('PDF_MAX_PAGES', '20'))
+
+
+def pixmap_to_array(pix):
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.n != 3:
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    img = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    return cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+
+def render_dpi(page):
+    long_side_points = max(page.rect.width, page.rect.height)
+    dpi = TARGET_LONG_SIDE * 72 / long_side_points
+    dpi = min(MAX_RENDER_DPI, max(MIN_RENDER_DPI, dpi))
+    # Oversized pages give up the minimum DPI rather than the pixel budget
+    return int(min(dpi, NATIVE_MAX_SIDE * 72 / long_side_points))
+
+def page_scan_xref(page):
+    # The xref of the image XObject that covers most of the page, or None if
+    # the page is not essentially one scanned image
+    page_area = abs(page.rect)
+    best_xref, best_coverage = None, 0.0
+    for image in page.get_images(full=True):
+        xref = image[0]
+        for rect in page.get_image_rects(xref):
+            coverage = abs(rect & page.rect) / page_area if page_area else 0.0
+            if coverage > best_coverage:
+                best_xref, best_coverage = xref, coverage
+    if best_coverage >= MIN_IMAGE_COVERAGE:
+        return best_xref
+    return None
+
+def decode_embedded_image(pdf_file, xref, reduced=False):
+    base_image = pdf_file.extract_image(xref)
+    check_pixels(base_image["width"], base_image["height"])
+    flags = cv2.IMREAD_REDUCED_COLOR_4 if reduced else cv2.IMREAD_COLOR
+    img = cv2.imdecode(np.frombuffer(base_image["image"], dtype=np.uint8), flags)
+    if img is None:
+        # Formats OpenCV cannot decode (JPX, CMYK, ...) go through MuPDF
+        img = pixmap_to_array(fitz.Pixmap(pdf_file, xref))
+    return img
+
+def page_image(pdf_file, page, preview=False):
+    # Embedded scans are decoded directly instead of rasterizing the page;
+    # preview=True returns a cheap low-resolution version for page scoring
+    xref = page_scan_xref(page)
+    if xref is not None:
+        img = decode_embedded_image(pdf_file, xref, reduced=preview)
+        return make_thumbnail(img)[0] if preview else fit(img, NATIVE_MAX_SIDE)[0]
+    dpi = PROBE_DPI if preview else render_dpi(page)
+    return pixmap_to_array(page.get_pixmap(dpi=dpi))
+
+def mrz_page_score(pdf_file, page):
+    # Born-digital pages may carry the MRZ in their text layer
+    text = page.get_text()
+    if '<<' in text and 'P<' in text:
+        return 2.0
+    gray = cv2.cvtColor(page_image(pdf_file, page, preview=True), cv2.COLOR_BGR2GRAY)
+    return max(mrz_band_coverage(gray).values())
+
+def iter_pdf_pages(pdf_file, max_pages=MAX_PDF_PAGES):
+    # Pages are loaded one at a time as the caller asks for them
+    for page_number in range(min(pdf_file.page_count, max_pages)):
+        yield pdf_file.load_page(page_number)
+
+def iter_pdf_images(pdf_bytes, max_pages=MAX_PDF_PAGES):
+    pdf_file = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        for page in iter_pdf_pages(pdf_file, max_pages):
+            yield page_image(pdf_file, page)
+    finally:
+        pdf_file.close()
+
+def select_mrz_page(pdf_file, max_pages=MAX_PDF_PAGES):
+    if pdf_file.page_count == 1:
+        return pdf_file.load_page(0)
+    best_page, best_score = None, -1.0
+    for page in iter_pdf_pages(pdf_file, max_pages):
+        score = mrz_page_score(pdf_file, page)
+        if score > best_score:
+            best_page, best_score = page, score
+    return best_page
+
+def extract_pdf_image(pdf_bytes, max_pages=MAX_PDF_PAGES):
+    # The page most likely to hold the MRZ, as a BGR array
+    pdf_file = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        if pdf_file.page_count == 0:
+            return None
+        return page_image(pdf_file, select_mrz_page(pdf_file, max_pages))
+    finally:
+        pdf_file.close()
 
 def process_pdf(pdf_path, upload_folder):
     if not os.path.exists(upload_folder):
         os.makedirs(upload_folder)
 
-    pdf_file = fitz.open(pdf_path)
-    page = pdf_file[0]  # Get only the first page
-    images = list(page.get_images(full=True))
-    
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    
-    if len(images) == 1:
-        img = images[0]
-        xref = img[0]
-        base_image = pdf_file.extract_image(xref)
-        image_bytes = base_image["image"]
-        image_save_path = os.path.join(upload_folder, f"image_{timestamp}.jpeg")
-        with open(image_save_path, "wb") as image_file:
-            image_file.write(image_bytes)
-    else:
-        # If no images found, save the first page as an image
-        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2)) 
-        image_save_path = os.path.join(upload_folder, f"image_{timestamp}.jpeg")
-        pix.save(image_save_path)
-
-    pdf_file.close()
+    with open(pdf_path, "rb") as pdf:
+        img = extract_pdf_image(pdf.read())
+
+    image_save_path = os.path.join(upload_folder, f"image_{uuid.uuid4().hex}.jpeg")
+    cv2.imwrite(image_save_path, img)
     return image_save_path
 '''
 if __name__ == "__main__":
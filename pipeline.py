@@ -0,0 +1,81 @@
+import os
+import uuid
+import cv2
+from werkzeug.utils import secure_filename
+from passport_ocr import get_data
+from orientation_detector import find_orientation
+from pdf_extractor import extract_pdf_image
+from metrics import timed
+from resolution import ImageTooLarge, check_bytes, decode_image
+from near_duplicates import NEAR_DUPLICATES, read_page
+
+ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'pdf'}
+
+
+class PipelineError(Exception):
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def is_pdf(filename):
+    return filename.lower().endswith('.pdf')
+
+def decode_upload(filename, data):
+    # Size limits are checked before decoding, and the result is capped at
+    # resolution.NATIVE_MAX_SIDE
+    try:
+        if is_pdf(filename):
+            check_bytes(len(data))
+            with timed('pdf_extraction'):
+                img = extract_pdf_image(data)
+        else:
+            with timed('image_decode'):
+                img = decode_image(data)
+    except ImageTooLarge as e:
+        raise PipelineError(str(e), 413)
+    if img is None:
+        raise PipelineError('Failed to load uploaded image', 500)
+    return img
+
+def orient_document(img):
+    with timed('orientation'):
+        angle, rotated_img, face = find_orientation(img)
+    if angle is None:
+        raise PipelineError('No face detected after rotating through 270 degrees.', 404)
+    return rotated_img, face
+
+def save_debug_file(debug_folder, name, data=None, img=None):
+    if not os.path.exists(debug_folder):
+        os.makedirs(debug_folder)
+    # A random prefix keeps concurrent requests from overwriting each other
+    path = os.path.join(debug_folder, f"{uuid.uuid4().hex}_{secure_filename(name)}")
+    if img is not None:
+        cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    else:
+        with open(path, 'wb') as f:
+            f.write(data)
+    return path
+
+def process_document(filename, data, debug_folder=None, mrz_only=False, file_hash=None, get_cached=None):
+    # With get_cached (file_hash -> cached result or None), full reads are
+    # first matched against near-duplicates of documents already cached
+    if debug_folder:
+        save_debug_file(debug_folder, filename, data=data)
+
+    img = decode_upload(filename, data)
+    rotated_img, face = orient_document(img)
+
+    if debug_folder:
+        save_debug_file(debug_folder, 'detected_face.jpeg', img=rotated_img)
+
+    try:
+        if NEAR_DUPLICATES and get_cached is not None and not mrz_only:
+            return read_page(rotated_img, filename, face, file_hash, get_cached)
+        return get_data(rotated_img, image_name=filename, mrz_only=mrz_only, face=face)
+    except Exception as e:
+        raise PipelineError(str(e), 500)
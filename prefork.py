@@ -0,0 +1,71 @@
+import gc
+import os
+import sys
+
+from ocr_engine import OCR_USE_GPU
+
+# Intra-op threads torch may use in each forked worker
+TORCH_THREADS = int(os.getenv('TORCH_THREADS', '1'))
+# Set by gunicorn.conf.py: this process is a server master that will fork
+# the workers after loading the app
+PREFORK_SERVER = os.getenv('PREFORK_SERVER', '0') == '1'
+
+
+# Preload-then-fork: the master process loads the easyocr weights, the dlib
+# detector and the gazetteer once and every forked worker shares those pages
+# copy-on-write. What keeps the pages shared and the forked state usable:
+#  - gc is off while the models load and everything is frozen right before
+#    each fork, so collections in a worker never write to the parent's
+#    objects; the parent turns gc back on once it has forked
+#  - torch runs single-threaded in the master and never runs inference there,
+#    so no OpenMP thread pool exists yet to be broken by the fork; workers
+#    set their own thread count afterwards
+#  - CUDA cannot be used across a fork at all, so GPU readers are refused
+#  - the dlib detector is a plain in-memory object and needs nothing
+#  - thread pools, database connections and the OCR batcher's threads are
+#    dropped in the worker and created again on first use
+
+_preloaded = False
+
+
+def will_fork():
+    return PREFORK_SERVER
+
+def preload(readiness, names):
+    global _preloaded
+    if _preloaded:
+        return
+    if OCR_USE_GPU:
+        raise RuntimeError("Models cannot be preloaded with OCR_USE_GPU=1: CUDA does not survive a fork. "
+                           "Use WARM_UP=background instead.")
+    gc.disable()
+    try:
+        import torch
+        torch.set_num_threads(1)
+        readiness.preload(names)
+    except BaseException:
+        gc.enable()
+        raise
+    os.register_at_fork(before=before_fork, after_in_parent=gc.enable,
+                        after_in_child=lambda: after_fork(readiness))
+    _preloaded = True
+
+def before_fork():
+    # Also freezes whatever the parent made since an earlier fork, e.g.
+    # before a worker is respawned
+    gc.freeze()
+
+def after_fork(readiness):
+    gc.enable()
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(TORCH_THREADS)
+
+    from db_utils import reset_pool
+    from ocr_batcher import reset_batcher
+    from result_cache import reset_result_cache
+    reset_pool()
+    reset_batcher()
+    reset_result_cache()
+    # The database steps (cache tables, leases) run in each worker
+    readiness.start()
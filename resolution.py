@@ -0,0 +1,154 @@
+import os
+import struct
+import cv2
+import numpy as np
+
+# Longest side each stage works at. Orientation probes use
+# ORIENTATION_PROBE_MAX_SIDE; crops handed to the recognizer are cut from the
+# decoded image, which is itself capped at NATIVE_MAX_SIDE.
+MRZ_MAX_SIDE = int(os.getenv('MRZ_MAX_SIDE', '1600'))
+OCR_MAX_SIDE = int(os.getenv('OCR_MAX_SIDE', '2200'))
+NATIVE_MAX_SIDE = int(os.getenv('NATIVE_MAX_SIDE', '3200'))
+# Uploads over these limits are rejected before anything is decoded
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', str(60_000_000)))
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(25 * 2**20)))
+
+# JPEG start-of-frame markers (all but DHT, JPG and DAC in C0-CF)
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def check_bytes(size, max_bytes=MAX_UPLOAD_BYTES):
+    if size > max_bytes:
+        raise ImageTooLarge(f"Upload of {size} bytes exceeds the {max_bytes} byte limit")
+
+def check_pixels(width, height, max_pixels=MAX_IMAGE_PIXELS):
+    if width * height > max_pixels:
+        raise ImageTooLarge(f"Image of {width}x{height} pixels exceeds the {max_pixels} pixel limit")
+
+def jpeg_dimensions(data):
+    # (width, height) from the JPEG frame header, without decoding; None if
+    # the data is not a JPEG or the header cannot be found
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        if marker in SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        i += 2 + struct.unpack('>H', data[i + 2:i + 4])[0]
+    return None
+
+def png_dimensions(data):
+    if data[:8] != b'\x89PNG\r\n\x1a\n' or data[12:16] != b'IHDR' or len(data) < 24:
+        return None
+    return struct.unpack('>II', data[16:24])
+
+def webp_dimensions(data):
+    if data[:4] != b'RIFF' or data[8:12] != b'WEBP' or len(data) < 30:
+        return None
+    chunk = data[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L':
+        bits = int.from_bytes(data[21:25], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        return int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1
+    return None
+
+def bmp_dimensions(data):
+    if data[:2] != b'BM' or len(data) < 26:
+        return None
+    header_size = struct.unpack('<I', data[14:18])[0]
+    if header_size == 12:
+        return struct.unpack('<HH', data[18:22])
+    width, height = struct.unpack('<ii', data[18:26])
+    return abs(width), abs(height)
+
+def tiff_dimensions(data):
+    # Width and height tags of the first IFD, which is the page OpenCV decodes
+    if data[:4] == b'II*\0':
+        order = '<'
+    elif data[:4] == b'MM\0*':
+        order = '>'
+    else:
+        return None
+    try:
+        offset = struct.unpack(order + 'I', data[4:8])[0]
+        count = struct.unpack(order + 'H', data[offset:offset + 2])[0]
+        size = {}
+        for i in range(count):
+            entry = data[offset + 2 + 12 * i:offset + 14 + 12 * i]
+            tag, kind = struct.unpack(order + 'HH', entry[:4])
+            if tag in (256, 257):
+                # SHORT or LONG values sit in the first bytes of the value field
+                size[tag] = struct.unpack(order + ('H' if kind == 3 else 'I'), entry[8:10 if kind == 3 else 12])[0]
+    except struct.error:
+        return None
+    if 256 not in size or 257 not in size:
+        return None
+    return size[256], size[257]
+
+def image_dimensions(data):
+    # (width, height) read from the header of any format we let OpenCV
+    # decode; None for everything else
+    for reader in (jpeg_dimensions, png_dimensions, webp_dimensions, bmp_dimensions, tiff_dimensions):
+        size = reader(data)
+        if size is not None:
+            return size
+    return None
+
+def fit(image, max_side):
+    # (image, scale) with the longest side at most max_side; scale maps
+    # coordinates from the original to the returned image
+    height, width = image.shape[:2]
+    scale = min(1.0, max_side / max(height, width))
+    if scale == 1.0:
+        return image, scale
+    resized = cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    return resized, scale
+
+def to_original(value, scale):
+    return int(round(value / scale))
+
+def decode_image(data, max_side=NATIVE_MAX_SIDE):
+    # Checks the byte and pixel limits, then lets libjpeg skip the detail we
+    # would throw away: big JPEGs are decoded at 1/2, 1/4 or 1/8 scale, as
+    # long as that still leaves at least max_side pixels on the long side.
+    # Data whose size cannot be read from its header is never decoded, so a
+    # pixel bomb in another format cannot slip past the pixel limit.
+    check_bytes(len(data))
+    size = image_dimensions(data)
+    if size is None:
+        return None
+    check_pixels(*size)
+    flags = cv2.IMREAD_COLOR
+    if jpeg_dimensions(data) is not None:
+        for factor, reduced_flags in REDUCED_DECODE_FLAGS:
+            if max(size) // factor >= max_side:
+                flags = reduced_flags
+                break
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+    if img is None:
+        return None
+    check_pixels(img.shape[1], img.shape[0])
+    return fit(img, max_side)[0]
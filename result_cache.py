@@ -0,0 +1,513 @@
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from metrics import CACHE_LOOKUPS
+
+RESULT_CACHE_BACKEND = os.getenv('RESULT_CACHE_BACKEND', 'mssql')
+RESULT_CACHE_SQLITE_PATH = os.getenv('RESULT_CACHE_SQLITE_PATH', 'file_cache.sqlite3')
+LOCAL_CACHE_SIZE = int(os.getenv('LOCAL_CACHE_SIZE', '1024'))
+LOCAL_CACHE_TTL = float(os.getenv('LOCAL_CACHE_TTL', '3600'))
+LOCAL_CACHE_NEGATIVE_TTL = float(os.getenv('LOCAL_CACHE_NEGATIVE_TTL', '30'))
+BULK_CHUNK = int(os.getenv('DB_BULK_CHUNK', '500'))
+
+# Stored in the local tier for hashes the backend does not have
+_MISSING = object()
+
+
+# Page hashes are unsigned 64-bit values; SQL Server and SQLite store signed
+def to_signed64(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def to_unsigned64(value):
+    return value & ((1 << 64) - 1)
+
+
+class LocalCache:
+    # Size-bounded LRU with a TTL per entry, guarded by one lock
+    def __init__(self, max_entries=LOCAL_CACHE_SIZE, ttl=LOCAL_CACHE_TTL, negative_ttl=LOCAL_CACHE_NEGATIVE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def get(self, key, hits_only=False):
+        # Returns the cached value, _MISSING for a cached miss, or None.
+        # hits_only counts a found value and nothing else, for a first look
+        # that is followed by a full lookup on a miss.
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if not hits_only:
+                    self._stats['misses'] += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self._stats['expirations'] += 1
+                if not hits_only:
+                    self._stats['misses'] += 1
+                return None
+            if hits_only and value is _MISSING:
+                return value
+            self._entries.move_to_end(key)
+            self._stats['negative_hits' if value is _MISSING else 'hits'] += 1
+            return value
+
+    def peek(self, key):
+        # Like get, but leaves the counters and the LRU order alone
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def put(self, key, value, ttl=None):
+        if self.max_entries <= 0:
+            return
+        if ttl is None:
+            ttl = self.negative_ttl if value is _MISSING else self.ttl
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['max_entries'] = self.max_entries
+        return stats
+
+
+class MSSQLBackend:
+    name = 'mssql'
+
+    def initialize(self):
+        from db_utils import initialize_database
+        initialize_database()
+
+    def initialize_page_hashes(self):
+        from db_utils import create_page_hash_table
+        create_page_hash_table()
+
+    def get(self, file_hash, conn=None):
+        from db_utils import get_cached_result
+        return get_cached_result(file_hash, conn)
+
+    def put(self, file_hash, file_name, data, conn=None):
+        from db_utils import cache_result
+        cache_result(file_hash, file_name, data, conn)
+
+    def get_many(self, file_hashes, conn=None):
+        from db_utils import get_cached_results
+        return get_cached_results(file_hashes, conn)
+
+    def put_rows(self, rows, conn=None):
+        from db_utils import cache_rows
+        return cache_rows(rows, conn)
+
+    def iter_rows(self, conn=None):
+        from db_utils import iter_cache_rows
+        return iter_cache_rows(conn)
+
+    def prune(self, max_age_seconds, conn=None):
+        from db_utils import prune_cache
+        return prune_cache(max_age_seconds, conn)
+
+    def put_page_hash(self, file_hash, page_hash, mrz, conn=None):
+        from db_utils import cache_page_hash
+        cache_page_hash(file_hash, to_signed64(page_hash), mrz, conn)
+
+    def iter_page_hashes(self, since=None, conn=None):
+        from db_utils import iter_page_hashes
+        for file_hash, page_hash, mrz, created_at in iter_page_hashes(since, conn):
+            yield file_hash, to_unsigned64(page_hash), mrz, created_at
+
+
+class SQLiteBackend:
+    # Stand-in for the MSSQL file_cache table in tests and local runs
+    name = 'sqlite'
+
+    def __init__(self, path=RESULT_CACHE_SQLITE_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def initialize(self):
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_cache ("
+                "    file_hash VARCHAR(32) PRIMARY KEY,"
+                "    file_name NVARCHAR(255),"
+                "    result TEXT,"
+                "    created_at DATETIME DEFAULT CURRENT_TIMESTAMP"
+                ")"
+            )
+            self._conn.commit()
+
+    def initialize_page_hashes(self):
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_cache_page_hash ("
+                "    file_hash VARCHAR(32) PRIMARY KEY,"
+                "    page_hash INTEGER NOT NULL,"
+                "    mrz TEXT,"
+                "    created_at DATETIME DEFAULT CURRENT_TIMESTAMP"
+                ")"
+            )
+            self._conn.commit()
+
+    def get(self, file_hash, conn=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_name, result FROM file_cache WHERE file_hash = ?", (file_hash,)
+            ).fetchone()
+        if row:
+            return {'file_name': row[0], 'result': json.loads(row[1])}
+        return None
+
+    def put(self, file_hash, file_name, data, conn=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_cache (file_hash, file_name, result, created_at) "
+                "VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+                (file_hash, file_name, json.dumps(data))
+            )
+            self._conn.commit()
+
+    def get_many(self, file_hashes, conn=None):
+        results = {}
+        file_hashes = list(dict.fromkeys(file_hashes))
+        with self._lock:
+            for start in range(0, len(file_hashes), BULK_CHUNK):
+                chunk = file_hashes[start:start + BULK_CHUNK]
+                placeholders = ', '.join(['?'] * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT file_hash, file_name, result FROM file_cache WHERE file_hash IN ({placeholders})", chunk
+                ).fetchall()
+                for file_hash, file_name, result in rows:
+                    results[file_hash] = {'file_name': file_name, 'result': json.loads(result)}
+        return results
+
+    def put_rows(self, rows, conn=None):
+        # One transaction for the lot
+        rows = [(file_hash, file_name, result, created_at) for file_hash, file_name, result, created_at in rows]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO file_cache (file_hash, file_name, result, created_at) "
+                "VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))",
+                rows
+            )
+            self._conn.commit()
+        return len(rows)
+
+    def iter_rows(self, conn=None):
+        last_hash = ''
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT file_hash, file_name, result, created_at FROM file_cache "
+                    "WHERE file_hash > ? ORDER BY file_hash LIMIT ?",
+                    (last_hash, BULK_CHUNK * 2)
+                ).fetchall()
+            yield from rows
+            if len(rows) < BULK_CHUNK * 2:
+                return
+            last_hash = rows[-1][0]
+
+    def prune(self, max_age_seconds, conn=None):
+        deleted = 0
+        while True:
+            with self._lock:
+                count = self._conn.execute(
+                    "DELETE FROM file_cache WHERE rowid IN (SELECT rowid FROM file_cache "
+                    "WHERE created_at < datetime('now', ?) LIMIT ?)",
+                    (f'-{int(max_age_seconds)} seconds', BULK_CHUNK * 2)
+                ).rowcount
+                self._conn.commit()
+            deleted += count
+            if count < BULK_CHUNK * 2:
+                return deleted
+
+    def put_page_hash(self, file_hash, page_hash, mrz, conn=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_cache_page_hash (file_hash, page_hash, mrz, created_at) "
+                "VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+                (file_hash, to_signed64(page_hash), mrz)
+            )
+            self._conn.commit()
+
+    def iter_page_hashes(self, since=None, conn=None):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT file_hash, page_hash, mrz, created_at FROM file_cache_page_hash WHERE created_at >= ?",
+                (since or '',)
+            ).fetchall()
+        for file_hash, page_hash, mrz, created_at in rows:
+            yield file_hash, to_unsigned64(page_hash), mrz, created_at
+
+
+def now_timestamp():
+    # created_at as SQLite's CURRENT_TIMESTAMP writes it (UTC)
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+
+class MemoryBackend:
+    name = 'memory'
+
+    def __init__(self):
+        self._rows = {}
+        self._page_hashes = {}
+        self._lock = threading.Lock()
+
+    def initialize(self):
+        pass
+
+    def initialize_page_hashes(self):
+        pass
+
+    def get(self, file_hash, conn=None):
+        with self._lock:
+            row = self._rows.get(file_hash)
+        if row:
+            return {'file_name': row[0], 'result': json.loads(row[1])}
+        return None
+
+    def put(self, file_hash, file_name, data, conn=None):
+        with self._lock:
+            self._rows[file_hash] = (file_name, json.dumps(data), now_timestamp())
+
+    def get_many(self, file_hashes, conn=None):
+        return {file_hash: result for file_hash in file_hashes
+                if (result := self.get(file_hash)) is not None}
+
+    def put_rows(self, rows, conn=None):
+        count = 0
+        with self._lock:
+            for file_hash, file_name, result, created_at in rows:
+                self._rows[file_hash] = (file_name, result, created_at or now_timestamp())
+                count += 1
+        return count
+
+    def iter_rows(self, conn=None):
+        with self._lock:
+            rows = sorted(self._rows.items())
+        for file_hash, (file_name, result, created_at) in rows:
+            yield file_hash, file_name, result, created_at
+
+    def prune(self, max_age_seconds, conn=None):
+        cutoff = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - max_age_seconds))
+        with self._lock:
+            expired = [key for key, row in self._rows.items() if row[2] < cutoff]
+            for key in expired:
+                del self._rows[key]
+        return len(expired)
+
+    def put_page_hash(self, file_hash, page_hash, mrz, conn=None):
+        with self._lock:
+            self._page_hashes[file_hash] = (page_hash, mrz, now_timestamp())
+
+    def iter_page_hashes(self, since=None, conn=None):
+        with self._lock:
+            rows = list(self._page_hashes.items())
+        for file_hash, (page_hash, mrz, created_at) in rows:
+            if since is None or created_at >= since:
+                yield file_hash, page_hash, mrz, created_at
+
+
+BACKENDS = {
+    'mssql': MSSQLBackend,
+    'sqlite': SQLiteBackend,
+    'memory': MemoryBackend,
+}
+
+
+class ResultCache:
+    # In-process LocalCache in front of a file_cache backend. Reads fill the
+    # local tier (including misses, for a short negative TTL) and writes go
+    # through to both tiers.
+    def __init__(self, backend, local=None):
+        self.backend = backend
+        self.local = local if local is not None else LocalCache()
+        self._lock = threading.Lock()
+        self._backend_stats = {'hits': 0, 'misses': 0, 'writes': 0}
+
+    def initialize(self):
+        self.backend.initialize()
+
+    def _count(self, key):
+        with self._lock:
+            self._backend_stats[key] += 1
+
+    def get(self, file_hash, conn=None):
+        value = self.local.get(file_hash)
+        if value is _MISSING:
+            CACHE_LOOKUPS.inc(tier='local', outcome='negative_hit')
+            return None
+        if value is not None:
+            CACHE_LOOKUPS.inc(tier='local', outcome='hit')
+            return value
+
+        result = self.backend.get(file_hash, conn=conn)
+        self._count('hits' if result else 'misses')
+        CACHE_LOOKUPS.inc(tier='backend', outcome='hit' if result else 'miss')
+        self.local.put(file_hash, result if result else _MISSING)
+        return result
+
+    def get_many(self, file_hashes, conn=None):
+        # {file_hash: result} for the cached ones; the local tier answers
+        # what it can and the rest go to the backend in one bulk lookup
+        found, missing = {}, []
+        for file_hash in dict.fromkeys(file_hashes):
+            value = self.local.get(file_hash)
+            if value is _MISSING:
+                CACHE_LOOKUPS.inc(tier='local', outcome='negative_hit')
+            elif value is not None:
+                CACHE_LOOKUPS.inc(tier='local', outcome='hit')
+                found[file_hash] = value
+            else:
+                missing.append(file_hash)
+        if missing:
+            results = self.backend.get_many(missing, conn=conn)
+            hits = len(results)
+            with self._lock:
+                self._backend_stats['hits'] += hits
+                self._backend_stats['misses'] += len(missing) - hits
+            CACHE_LOOKUPS.inc(hits, tier='backend', outcome='hit')
+            CACHE_LOOKUPS.inc(len(missing) - hits, tier='backend', outcome='miss')
+            for file_hash in missing:
+                result = results.get(file_hash)
+                self.local.put(file_hash, result if result else _MISSING)
+            found.update(results)
+        return found
+
+    def peek(self, file_hash, conn=None):
+        # A cached result for callers that count their own lookups, such as
+        # the near-duplicate tier: no tier's hit and miss counts move, and
+        # only found results are kept locally
+        value = self.local.peek(file_hash)
+        if value is _MISSING:
+            return None
+        if value is not None:
+            return value
+        result = self.backend.get(file_hash, conn=conn)
+        if result:
+            self.local.put(file_hash, result)
+        return result
+
+    def get_local(self, file_hash):
+        # Only the in-process tier, for callers that must not wait on the
+        # backend. Misses are left for the get() that follows to count.
+        value = self.local.get(file_hash, hits_only=True)
+        if value is None or value is _MISSING:
+            return None
+        CACHE_LOOKUPS.inc(tier='local', outcome='hit')
+        return value
+
+    def put(self, file_hash, file_name, data, conn=None):
+        self.backend.put(file_hash, file_name, data, conn=conn)
+        self._count('writes')
+        self.local.put(file_hash, {'file_name': file_name, 'result': data})
+
+    def put_many(self, items, conn=None):
+        # items: (file_hash, file_name, data) triples, written in bulk
+        items = list(items)
+        rows = [(file_hash, file_name, json.dumps(data), None) for file_hash, file_name, data in items]
+        written = self.backend.put_rows(rows, conn=conn)
+        with self._lock:
+            self._backend_stats['writes'] += written
+        for file_hash, file_name, data in items:
+            self.local.put(file_hash, {'file_name': file_name, 'result': data})
+        return written
+
+    def export(self, path):
+        # Gzipped JSON lines of [file_hash, file_name, created_at, result];
+        # the stored result JSON is copied through without being parsed
+        count = 0
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            for file_hash, file_name, result, created_at in self.backend.iter_rows():
+                f.write(f'[{json.dumps(file_hash)}, {json.dumps(file_name)}, {json.dumps(created_at)}, {result}]\n')
+                count += 1
+        return count
+
+    def import_(self, path, chunk_size=BULK_CHUNK):
+        # Loads an export in chunks, keeping each row's created_at; the local
+        # tier is cleared since it may now disagree with the backend
+        def rows():
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        file_hash, file_name, created_at, result = json.loads(line)
+                        yield file_hash, file_name, json.dumps(result), created_at
+
+        count = 0
+        chunk = []
+        for row in rows():
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                count += self.backend.put_rows(chunk)
+                chunk = []
+        if chunk:
+            count += self.backend.put_rows(chunk)
+        self.local.clear()
+        return count
+
+    def prune(self, max_age_seconds, conn=None):
+        deleted = self.backend.prune(max_age_seconds, conn=conn)
+        self.local.clear()
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            backend_stats = dict(self._backend_stats)
+        backend_stats['backend'] = self.backend.name
+        return {'local': self.local.stats(), 'backend': backend_stats}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def make_backend(name=RESULT_CACHE_BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown result cache backend '{name}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name]()
+
+def get_result_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache(make_backend())
+    return _cache
+
+def reset_result_cache():
+    # In a forked child, so the backend (e.g. a SQLite connection) is opened
+    # again instead of shared with the parent
+    global _cache, _cache_lock
+    _cache = None
+    _cache_lock = threading.Lock()
+
+def configure_result_cache(backend, local=None):
+    global _cache
+    with _cache_lock:
+        _cache = ResultCache(backend, local)
+    return _cache
@@ -0,0 +1,117 @@
+import os
+import socket
+import threading
+import time
+import uuid
+
+# Coordinate identical uploads across worker processes through a lease row
+# in the database, on top of the in-process single flight
+SINGLE_FLIGHT_LEASES = os.getenv('SINGLE_FLIGHT_LEASES', '0') == '1'
+LEASE_TTL = int(os.getenv('SINGLE_FLIGHT_LEASE_TTL', '120'))
+LEASE_POLL_INTERVAL = float(os.getenv('SINGLE_FLIGHT_LEASE_POLL', '0.5'))
+# How long a request waits for another process's result before computing it
+# itself; kept well below the server's request timeout (WEB_TIMEOUT)
+LEASE_MAX_WAIT = float(os.getenv('SINGLE_FLIGHT_LEASE_MAX_WAIT', '30'))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    # Runs at most one call per key at a time. Callers arriving while a call
+    # for their key is in flight wait for it and get its result (or error)
+    # instead of repeating the work.
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'leaders': 0, 'followers': 0}
+
+    def do(self, key, fn, *args, **kwargs):
+        # Returns (result, shared), where shared is True for followers
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats['followers'] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats['leaders'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+
+class CacheLease:
+    # Cross-process single flight through the file_cache_lease table: the
+    # process holding an unexpired lease computes, the others poll file_cache
+    # until the result shows up, the lease lapses and they can take over, or
+    # max_wait runs out and they compute it themselves.
+    def __init__(self, ttl=LEASE_TTL, poll_interval=LEASE_POLL_INTERVAL, max_wait=LEASE_MAX_WAIT):
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+        self._owner = None
+        self._owner_pid = None
+
+    @property
+    def owner(self):
+        # Made per process rather than in __init__: with a preloaded server
+        # this object is built in the master, and every forked worker must
+        # still hold leases under a name of its own
+        pid = os.getpid()
+        if self._owner_pid != pid:
+            self._owner = f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:8]}"
+            self._owner_pid = pid
+        return self._owner
+
+    def initialize(self):
+        from db_utils import create_lease_table
+        create_lease_table()
+
+    def acquire_or_wait(self, file_hash, lookup):
+        # Returns (True, None) once this process holds the lease, (False,
+        # result) when another process published the result first, or
+        # (False, None) when max_wait ran out. Every query borrows its own
+        # pooled connection, so none is held while sleeping.
+        from db_utils import acquire_lease
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            if acquire_lease(file_hash, self.owner, self.ttl):
+                return True, None
+            if time.monotonic() >= deadline:
+                return False, None
+            time.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+            result = lookup()
+            if result:
+                return False, result
+
+    def release(self, file_hash):
+        from db_utils import release_lease
+        release_lease(file_hash, self.owner)
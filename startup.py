@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from memory import process_memory
+
+# background: serve liveness right away and report ready once warm-up is done
+# blocking:   finish warm-up before create_app returns
+# preload:    load the models in the current process before a preforking
+#             server forks its workers (see prefork.py); each worker then
+#             runs the remaining steps in the background. Without such a
+#             server it falls back to background.
+# off:        never warm up, everything loads on first use
+WARM_UP_MODE = os.getenv('WARM_UP', 'background')
+WARM_UP_RETRY_DELAY = float(os.getenv('WARM_UP_RETRY_DELAY', '5'))
+
+
+def warm_ocr_readers():
+    from ocr_engine import get_reader_pool
+    get_reader_pool().warm_up()
+
+def load_face_detector():
+    from orientation_detector import get_detector
+    get_detector()
+
+def load_gazetteer():
+    from gazetteer import get_gazetteer
+    get_gazetteer()
+
+MODEL_STEPS = [
+    ('ocr_readers', warm_ocr_readers),
+    ('face_detector', load_face_detector),
+    ('gazetteer', load_gazetteer),
+]
+MODEL_STEP_NAMES = [name for name, _ in MODEL_STEPS]
+
+def load_models():
+    for _, step in MODEL_STEPS:
+        step()
+
+
+class Readiness:
+    # Runs the named warm-up steps once, in order, and keeps retrying the ones
+    # that fail (e.g. the database is not up yet) without holding back the
+    # rest. The service is ready when every step has succeeded.
+    def __init__(self, steps, retry_delay=WARM_UP_RETRY_DELAY):
+        self.steps = list(steps)
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._status = {name: 'pending' for name, _ in self.steps}
+        self._errors = {}
+        self._durations = {}
+        # Private bytes the process grew by during each step
+        self._memory = {}
+        self._started_at = None
+        self._ready_at = None
+
+    @property
+    def started(self):
+        return self._started_at is not None
+
+    def start(self, blocking=False):
+        with self._lock:
+            if self._started_at is not None:
+                return
+            self._started_at = time.monotonic()
+        if blocking:
+            self.run()
+        else:
+            threading.Thread(target=self.run, name='warm-up', daemon=True).start()
+
+    def preload(self, names):
+        # Runs the named steps right away in this process and raises if one
+        # fails; start() later only runs the steps still pending
+        for name, step in self.steps:
+            if name in names and not self._run_step(name, step):
+                raise RuntimeError(f"Preloading {name} failed: {self._errors[name]}")
+
+    def _set(self, name, status, error=None, duration=None):
+        with self._lock:
+            self._status[name] = status
+            if error is None:
+                self._errors.pop(name, None)
+            else:
+                self._errors[name] = error
+            if duration is not None:
+                self._durations[name] = duration
+
+    def _run_step(self, name, step):
+        self._set(name, 'running')
+        memory_before = process_memory()
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            self._set(name, 'failed', f"{type(e).__name__}: {e}")
+            return False
+        self._set(name, 'ready', duration=time.perf_counter() - start)
+        memory_after = process_memory()
+        if memory_before and memory_after:
+            with self._lock:
+                self._memory[name] = memory_after['private'] - memory_before['private']
+        return True
+
+    def run(self):
+        with self._lock:
+            pending = [(name, step) for name, step in self.steps if self._status[name] != 'ready']
+        while pending:
+            pending = [(name, step) for name, step in pending if not self._run_step(name, step)]
+            if pending:
+                time.sleep(self.retry_delay)
+        with self._lock:
+            self._ready_at = time.monotonic()
+
+    def is_ready(self):
+        with self._lock:
+            return self._ready_at is not None
+
+    def status(self):
+        with self._lock:
+            return {
+                'ready': self._ready_at is not None,
+                'steps': dict(self._status),
+                'errors': dict(self._errors),
+                'step_seconds': dict(self._durations),
+                'step_memory_bytes': dict(self._memory),
+                'warm_up_seconds': (self._ready_at - self._started_at) if self._ready_at is not None else None,
+            }
@@ -0,0 +1,165 @@
+import datetime
+import re
+from dateutil import parser
+from fuzzywuzzy import fuzz
+from gazetteer import get_gazetteer, trigrams
+
+# Runs of word characters (bar '_') and '<': exactly the words that
+# city_extraction.preprocess_text leaves, lower-cased in one go
+TOKEN_PATTERN = re.compile(r'(?:[^\W_]|<)+')
+DATE_PATTERN = re.compile(r'(\d{1,2})\s*/\s*(\d{1,2})\s*/\s*(\d{2,4})')
+DAY_FIRST_PATTERN = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})')
+CONTEXT_KEYWORDS = ("birth", "issue", "issued", "place", "of", "date")
+# Words either side of a candidate that are searched for context keywords
+CONTEXT_BEFORE = 12
+CONTEXT_AFTER = 15
+# Leading words of the full page (header and names) never hold a place
+SKIP_WORDS = 10
+# Field labels that sit inside the place crops from field_regions
+LABEL_WORDS = {'place', 'of', 'birth', 'issue'}
+
+
+def context_counts(tokens):
+    # Prefix sums over "token contains a context keyword", so any window can
+    # be checked in O(1) instead of joining and searching its words
+    counts = [0]
+    total = 0
+    for token in tokens:
+        total += any(keyword in token for keyword in CONTEXT_KEYWORDS)
+        counts.append(total)
+    return counts
+
+def day_first_date(first, second, year):
+    # "first/second/year" with a four-digit year, resolved the way
+    # dateutil.parser.parse(..., dayfirst=True) resolves it: day first unless
+    # that cannot work. Returns None for an impossible date.
+    if first > 31:
+        year, month, day = (first, year, second) if year <= 12 else (first, second, year)
+    elif first > 12 or second <= 12:
+        day, month = first, second
+    else:
+        day, month = second, first
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+def parse_day_first(text):
+    match = DAY_FIRST_PATTERN.fullmatch(text)
+    if match is None:
+        return parser.parse(text, dayfirst=True).date()
+    date = day_first_date(*(int(group) for group in match.groups()))
+    if date is None:
+        raise ValueError(f"Invalid date {text}")
+    return date
+
+
+class TextAnalysis:
+    # One OCR text, tokenized once. City and state tokens, the context
+    # keyword windows around them and the candidate dates are all found from
+    # these tokens (dates from one scan of the raw text, since preprocessing
+    # drops the slashes), so post-processing stays linear in the text size.
+    def __init__(self, text, tokens=None):
+        self.text = text
+        self.tokens = TOKEN_PATTERN.findall(text.lower()) if tokens is None else tokens
+        self._context = context_counts(self.tokens)
+        # word -> (city, state, score without context) of its best fuzzy match
+        self._matches = {}
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        return cls(' '.join(tokens), list(tokens))
+
+    def has_context(self, start, end):
+        start = max(0, start)
+        end = min(len(self.tokens), end)
+        return end > start and self._context[end] > self._context[start]
+
+    def _fuzzy_match(self, word):
+        # Best gazetteer city for word, scored like calculate_match_score
+        # minus the context bonus; tokens are lower-case already
+        if word not in self._matches:
+            gazetteer = get_gazetteer()
+            word_grams = trigrams(word)
+            best = (None, None, 0)
+            for entry_id, city, state, city_name in gazetteer.fuzzy_candidates(word):
+                if word in city_name:
+                    score = 100
+                elif len(word) >= 4 and fuzz.partial_ratio(word, city_name) >= 90:
+                    score = 80
+                else:
+                    continue
+                score += len(word_grams & gazetteer.grams(entry_id)) * 5
+                if score > best[2]:
+                    best = (city, state, score)
+            self._matches[word] = best
+        return self._matches[word]
+
+    def best_match(self, word, start_index, end_index):
+        # Same result as city_extraction.find_best_match over self.tokens
+        city, state, score = self._fuzzy_match(word)
+        if city is None:
+            return {"city": None, "state": None, "score": 0, "position": start_index}
+        if self.has_context(start_index - CONTEXT_BEFORE, end_index + CONTEXT_AFTER):
+            score += 25
+        return {"city": city, "state": state, "score": score, "position": start_index}
+
+    def scan_places(self):
+        # (exact city matches, fuzzy city matches, states) over the page
+        gazetteer = get_gazetteer()
+        exact_matches = []
+        detected_cities = []
+        detected_states = []
+        count = len(self.tokens)
+        for i, word in enumerate(self.tokens[SKIP_WORDS:]):
+            if len(word) < 3:
+                continue
+            exact_match = gazetteer.exact_match(word)
+            if exact_match:
+                city, state = exact_match
+                exact_matches.append({"city": city, "state": state, "position": i + 17})
+            else:
+                match = self.best_match(word, max(0, i - CONTEXT_BEFORE), min(count, i + CONTEXT_AFTER))
+                if match["score"] > 80:
+                    detected_cities.append({"city": match['city'], "state": match['state'], "position": i + 17})
+            detected_states.extend(gazetteer.states_for(word))
+        return exact_matches, detected_cities, list(set(detected_states))
+
+    def best_place(self):
+        # The city named in a single field crop as {"city", "state"}, or None
+        gazetteer = get_gazetteer()
+        best = {"city": None, "state": None, "score": 0}
+        for i, word in enumerate(self.tokens):
+            # Labels stay in the tokens so they still count as context
+            if len(word) < 3 or word in LABEL_WORDS:
+                continue
+            exact_match = gazetteer.exact_match(word)
+            if exact_match:
+                city, state = exact_match
+                return {"city": city, "state": state}
+            match = self.best_match(word, i, i)
+            if match["score"] > max(80, best["score"]):
+                best = match
+        return best if best["city"] is not None else None
+
+    def date_candidates(self):
+        # Every d/m/y in the text as dd/mm/yyyy, in order of appearance
+        century = str(datetime.datetime.now().year)[:2]
+        candidates = []
+        for match in DATE_PATTERN.finditer(self.text):
+            day, month, year = match.groups()
+            if len(year) == 3:
+                year = "2" + year
+            elif len(year) == 2:
+                year = century + year
+            candidates.append(f"{day.zfill(2)}/{month.zfill(2)}/{year}")
+        return candidates
+
+    def date_of_issue(self, dob, expiry_date):
+        # The first date that is neither the date of birth nor of expiry
+        excluded = {parse_day_first(dob), parse_day_first(expiry_date)}
+        for candidate in self.date_candidates():
+            date = day_first_date(*(int(part) for part in candidate.split('/')))
+            if date is not None and date not in excluded:
+                return candidate
+        return None